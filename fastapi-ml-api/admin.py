@@ -0,0 +1,82 @@
+import asyncio
+import os
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from pydantic import BaseModel
+from registry import model_registry
+
+# the admin endpoints are disabled unless a token is configured, since they
+# load pickles; artifacts can only come from MODEL_DIR
+ADMIN_TOKEN = os.getenv("ML_API_ADMIN_TOKEN", "")
+MODEL_DIR = os.path.realpath(os.getenv("ML_API_MODEL_DIR", "."))
+
+# every worker process has its own registry and these endpoints only change
+# the one of the worker that serves the request: with several uvicorn
+# workers, roll out a model by replacing the watched artifact instead
+# (ML_API_MODEL_WATCH_SECONDS), which all workers pick up. /models reports
+# the pid of the worker that answered.
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+class ModelArtifact(BaseModel):
+    path: str
+
+
+router = APIRouter(prefix='/models')
+
+
+@router.get('')
+def list_models():
+    # versions, which one is live or in shadow, and their latency/agreement
+    return model_registry.info()
+
+
+@router.post('/{name}', dependencies=[Depends(require_admin)])
+async def add_model(name: str, artifact: ModelArtifact):
+    path = os.path.realpath(os.path.join(MODEL_DIR, artifact.path))
+    if os.path.commonpath([path, MODEL_DIR]) != MODEL_DIR or not os.path.isfile(path):
+        raise HTTPException(status_code=400, detail="No such artifact in the model directory")
+    if name in model_registry.versions:
+        raise HTTPException(status_code=409, detail="Model version already exists")
+    # loading and warming up takes a while, keep serving meanwhile
+    try:
+        version = await asyncio.to_thread(model_registry.add, name, path)
+    except Exception as exc:
+        if name in model_registry.versions:
+            raise HTTPException(status_code=409, detail="Model version already exists")
+        raise HTTPException(status_code=400, detail=f"Could not load the artifact: {exc}")
+    return version.info()
+
+
+@router.post('/{name}/activate', dependencies=[Depends(require_admin)])
+def activate_model(name: str):
+    if name not in model_registry.versions:
+        raise HTTPException(status_code=404, detail="Model version not found")
+    model_registry.activate(name)
+    return model_registry.info()
+
+
+@router.post('/{name}/shadow', dependencies=[Depends(require_admin)])
+def shadow_model(name: str, rate: float = Query(0.1, ge=0, le=1)):
+    """Scores a `rate` fraction of batches with this version too; 0 stops."""
+    if name not in model_registry.versions:
+        raise HTTPException(status_code=404, detail="Model version not found")
+    if model_registry.versions[name] is model_registry.active:
+        raise HTTPException(status_code=400, detail="The active version can't be its own shadow")
+    model_registry.set_shadow(name if rate > 0 else None, rate)
+    return model_registry.info()
+
+
+@router.delete('/{name}', dependencies=[Depends(require_admin)])
+def remove_model(name: str):
+    if name not in model_registry.versions:
+        raise HTTPException(status_code=404, detail="Model version not found")
+    if model_registry.versions[name] is model_registry.active:
+        raise HTTPException(status_code=400, detail="The active version can't be removed")
+    model_registry.remove(name)
+    return model_registry.info()
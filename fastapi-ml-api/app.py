@@ -1,25 +1,51 @@
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, computed_field
-from typing import Literal, Annotated
-import pickle
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, computed_field
+from typing import Literal, Annotated, List
+import asyncio
+import json
+import os
 import pandas as pd
+from batcher import MicroBatcher
+from features import CITY_TIERS, OTHER_CITY_TIER, OCCUPATIONS
+from admin import router as models_router
+from cache import prediction_cache
+from inference import InferenceExecutor
+from registry import WATCH_INTERVAL, model_registry
 
-# import the ml model
-with open('model.pkl', 'rb') as f:
-    model = pickle.load(f)
+# the ml model is loaded at startup instead of at import, see registry.py
+executor = InferenceExecutor(model_registry, cache=prediction_cache)
 
-app = FastAPI()
 
-tier_1_cities = ["Mumbai", "Delhi", "Bangalore", "Chennai", "Kolkata", "Hyderabad", "Pune"]
-tier_2_cities = [
-    "Jaipur", "Chandigarh", "Indore", "Lucknow", "Patna", "Ranchi", "Visakhapatnam", "Coimbatore",
-    "Bhopal", "Nagpur", "Vadodara", "Surat", "Rajkot", "Jodhpur", "Raipur", "Amritsar", "Varanasi",
-    "Agra", "Dehradun", "Mysore", "Jabalpur", "Guwahati", "Thiruvananthapuram", "Ludhiana", "Nashik",
-    "Allahabad", "Udaipur", "Aurangabad", "Hubli", "Belgaum", "Salem", "Vijayawada", "Tiruchirappalli",
-    "Bhavnagar", "Gwalior", "Dhanbad", "Bareilly", "Aligarh", "Gaya", "Kozhikode", "Warangal",
-    "Kolhapur", "Bilaspur", "Jalandhar", "Noida", "Guntur", "Asansol", "Siliguri"
-]
+async def predict_rows(rows):
+    # one model.predict for the whole micro-batch
+    return await executor.predict({field: [row[field] for row in rows] for field in rows[0]})
+
+
+batcher = MicroBatcher(predict_rows, max_in_flight=executor.workers)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(model_registry.warmup)
+    await prediction_cache.start()
+    await executor.start()
+    await batcher.start()
+    watcher = asyncio.create_task(model_registry.watch()) if WATCH_INTERVAL > 0 else None
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    await batcher.stop()
+    await executor.stop()
+    await prediction_cache.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(models_router)
+
+# /predict/batch validates, derives and predicts this many rows at a time
+BATCH_CHUNK = int(os.getenv("ML_API_BATCH_CHUNK", "1000"))
 
 # pydantic model to validate incoming data
 class UserInput(BaseModel):
@@ -30,8 +56,7 @@ class UserInput(BaseModel):
     income_lpa: Annotated[float, Field(..., gt=0, description='Annual salary of the user in lpa')]
     smoker: Annotated[bool, Field(..., description='Is user a smoker')]
     city: Annotated[str, Field(..., description='The city that the user belongs to')]
-    occupation: Annotated[Literal['retired', 'freelancer', 'student', 'government_job',
-       'business_owner', 'unemployed', 'private_job'], Field(..., description='Occupation of the user')]
+    occupation: Annotated[Literal[OCCUPATIONS], Field(..., description='Occupation of the user')]
     
     @computed_field
     @property
@@ -41,9 +66,10 @@ class UserInput(BaseModel):
     @computed_field
     @property
     def lifestyle_risk(self) -> str:
-        if self.smoker and self.bmi > 30:
+        bmi = self.bmi
+        if self.smoker and bmi > 30:
             return "high"
-        elif self.smoker or self.bmi > 27:
+        elif self.smoker or bmi > 27:
             return "medium"
         else:
             return "low"
@@ -62,30 +88,120 @@ class UserInput(BaseModel):
     @computed_field
     @property
     def city_tier(self) -> int:
-        if self.city in tier_1_cities:
-            return 1
-        elif self.city in tier_2_cities:
-            return 2
-        else:
-            return 3
+        return CITY_TIERS.get(self.city, OTHER_CITY_TIER)
 
 @app.post('/predict')
-def predict_premium(data: UserInput):
-
-    input_df = pd.DataFrame([{
-        'bmi': data.bmi,
-        'age_group': data.age_group,
-        'lifestyle_risk': data.lifestyle_risk,
-        'city_tier': data.city_tier,
-        'income_lpa': data.income_lpa,
-        'occupation': data.occupation
-    }])
+async def predict_premium(data: UserInput):
 
-    prediction = model.predict(input_df)[0]
+    # features are derived for the whole micro-batch at once
+    prediction = await batcher.predict(dict(data))
 
     return JSONResponse(status_code=200, content={'predicted_category': prediction})
 
 
+@app.get('/cache-metrics')
+def cache_metrics():
+    return prediction_cache.snapshot()
+
+
+user_inputs = TypeAdapter(List[UserInput])
+
+
+def validate_chunk(rows):
+    # validate the whole chunk in one call, retry without the rows that failed
+    errors = {}
+    try:
+        return user_inputs.validate_python(rows), errors
+    except ValidationError as exc:
+        for error in exc.errors(include_url=False, include_context=False, include_input=False):
+            index, *loc = error['loc']
+            errors.setdefault(index, []).append({**error, 'loc': loc})
+    valid = [row for i, row in enumerate(rows) if i not in errors]
+    return user_inputs.validate_python(valid), errors
+
+
+def validate_rows(rows):
+    # the error line for every invalid row, the valid ones as columns
+    results = [None] * len(rows)
+    parsed = []
+    for i, row in enumerate(rows):
+        if isinstance(row, Exception):
+            results[i] = {'error': [{'type': 'json_invalid', 'msg': str(row)}]}
+        else:
+            parsed.append((i, row))
+    inputs, errors = validate_chunk([row for _, row in parsed])
+    positions = []
+    for j, (i, _) in enumerate(parsed):
+        if j in errors:
+            results[i] = {'error': errors[j]}
+        else:
+            positions.append(i)
+    return results, positions, pd.DataFrame([dict(data) for data in inputs])
+
+
+async def score_chunk(rows):
+    """Scores one chunk of raw rows, returns one NDJSON line per row."""
+    results, positions, users = await asyncio.to_thread(validate_rows, rows)
+    if positions:
+        for i, prediction in zip(positions, await executor.predict(users)):
+            results[i] = {'predicted_category': prediction}
+    return ''.join(json.dumps(result) + '\n' for result in results)
+
+
+async def ndjson_rows(request):
+    buffer = b''
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    # the NDJSON body is read while the response streams, so don't let
+    # Starlette's disconnect listener race the body reader for receive();
+    # a disconnect surfaces as ClientDisconnect from request.stream()
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+async def score_ndjson(request):
+    chunk = []
+    async for line in ndjson_rows(request):
+        try:
+            chunk.append(json.loads(line))
+        except ValueError as exc:
+            chunk.append(exc)
+        if len(chunk) == BATCH_CHUNK:
+            yield await score_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield await score_chunk(chunk)
+
+
+async def score_array(rows):
+    for start in range(0, len(rows), BATCH_CHUNK):
+        yield await score_chunk(rows[start:start + BATCH_CHUNK])
+
 
+@app.post('/predict/batch')
+async def predict_premium_batch(request: Request):
+    """Scores a JSON array of users or an NDJSON stream (Content-Type:
+    application/x-ndjson). Answers with one NDJSON line per input row, in
+    order: the predicted category or the row's validation errors."""
 
+    if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+        results = score_ndjson(request)
+    else:
+        try:
+            rows = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=422, detail='Body must be a JSON array or NDJSON')
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=422, detail='Body must be a JSON array or NDJSON')
+        results = score_array(rows)
 
+    return DuplexStreamingResponse(results, media_type='application/x-ndjson')
@@ -0,0 +1,107 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# a batch is predicted after MAX_WAIT seconds or once MAX_BATCH rows are
+# waiting, whichever comes first
+MAX_BATCH = int(os.getenv("ML_API_MAX_BATCH", "64"))
+MAX_WAIT = float(os.getenv("ML_API_MAX_WAIT_MS", "2")) / 1000
+
+# takes a list of rows, returns one prediction per row
+TPredictFn = Callable[[List[Dict[str, Any]]], Awaitable[List[Any]]]
+
+
+class MicroBatcher:
+    """Turns concurrent single-row predictions into one vectorized call.
+
+    Handlers await `predict(row)`; a background task gathers the rows that
+    arrive together, awaits `predict_fn` once for all of them and hands
+    every caller its own result. Up to `max_in_flight` batches run at once,
+    rows that arrive while all of them are busy make the next batch bigger.
+    """
+
+    def __init__(
+        self,
+        predict_fn: TPredictFn,
+        max_batch: int = MAX_BATCH,
+        max_wait: float = MAX_WAIT,
+        max_in_flight: int = 1,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.batch_ready = asyncio.Event()
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.running: Set[asyncio.Task] = set()
+        self.runner: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.rows = 0
+
+    async def start(self):
+        self.runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.runner is None:
+            return
+        # the runner predicts whatever is queued ahead of the None and exits
+        await self.queue.put(None)
+        self.batch_ready.set()
+        await self.runner
+        self.runner = None
+
+    async def predict(self, row: Dict[str, Any]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((row, future))
+        if self.queue.qsize() >= self.max_batch:
+            self.batch_ready.set()
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is not None and self.queue.qsize() < self.max_batch - 1:
+                try:
+                    await asyncio.wait_for(
+                        self.batch_ready.wait(), timeout=self.max_wait
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            await self.in_flight.acquire()
+            batch = [first] + self._take(self.max_batch - 1)
+            if self.queue.qsize() < self.max_batch:
+                self.batch_ready.clear()
+            stopping = None in batch
+            task = asyncio.create_task(
+                self._predict([item for item in batch if item is not None])
+            )
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+        await asyncio.gather(*self.running)
+
+    def _take(self, limit: int) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _predict(self, batch):
+        # callers that went away (client disconnected) don't need a result
+        batch = [(row, future) for row, future in batch if not future.done()]
+        try:
+            if not batch:
+                return
+            results = await self.predict_fn([row for row, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        finally:
+            self.in_flight.release()
+        self.batches += 1
+        self.rows += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,83 @@
+"""Micro-batched /predict throughput with and without the prediction cache.
+
+Requests replay the applicants of insurance.csv, popular ones more often
+(Zipf), then random applicants with and without bmi/income quantization.
+Run from the `fastapi-ml-api` directory:
+
+    python -m benchmarks.cache
+"""
+import asyncio
+import csv
+import random
+import time
+from batcher import MicroBatcher
+from cache import PredictionCache
+from inference import InferenceExecutor
+from registry import model_registry
+from benchmarks.features import random_user
+
+REQUESTS = 20_000
+CONCURRENCY = 256
+
+
+def applicants():
+    with open('insurance.csv') as f:
+        rows = list(csv.DictReader(f))
+    return [{
+        'age': int(row['age']),
+        'weight': float(row['weight']),
+        'height': float(row['height']),
+        'income_lpa': float(row['income_lpa']),
+        'smoker': row['smoker'] == 'True',
+        'city': row['city'],
+        'occupation': row['occupation'],
+    } for row in rows]
+
+
+def zipf_requests(users):
+    weights = [1 / rank for rank in range(1, len(users) + 1)]
+    return random.choices(users, weights, k=REQUESTS)
+
+
+async def run(name, requests, cache):
+    executor = InferenceExecutor(model_registry, cache=cache)
+    await executor.start()
+
+    async def predict(rows):
+        return await executor.predict({field: [row[field] for row in rows] for field in rows[0]})
+
+    batcher = MicroBatcher(predict, max_in_flight=executor.workers)
+    await batcher.start()
+    queue = iter(requests)
+
+    async def client():
+        for row in queue:
+            await batcher.predict(row)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    await batcher.stop()
+    await executor.stop()
+    hit_rate = cache.snapshot()['hit_rate'] if cache is not None else None
+    print(
+        f"{name:<36} | {len(requests) / elapsed:8.1f} req/s | "
+        f"hit rate {'-' if hit_rate is None else f'{hit_rate:.1%}'}"
+    )
+
+
+async def main():
+    model_registry.warmup()
+    zipf = zipf_requests(applicants())
+    await run("applicants, no cache", zipf, None)
+    await run("applicants, cache", zipf, PredictionCache(redis_url=None))
+    randoms = [random_user() for _ in range(REQUESTS)]
+    await run("random users, cache", randoms, PredictionCache(redis_url=None))
+    await run(
+        "random users, cache, bmi/income 1.0", randoms,
+        PredictionCache(bmi_step=1.0, income_step=1.0, redis_url=None),
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Feature derivation, UserInput properties per object vs. derive_features.
+
+First checks that derive_features gives exactly the values of the
+UserInput computed fields (golden check over random rows and the bin
+edges), then measures rows/s. Run from the `fastapi-ml-api` directory:
+
+    python -m benchmarks.features
+"""
+import random
+import time
+import pandas as pd
+from app import UserInput
+from features import FEATURE_COLUMNS, derive_features, tier_1_cities, tier_2_cities
+
+OCCUPATIONS = ['retired', 'freelancer', 'student', 'government_job',
+               'business_owner', 'unemployed', 'private_job']
+CITIES = tier_1_cities + tier_2_cities + ['Springfield', 'Atlantis', 'mumbai']
+
+
+def random_user():
+    return {
+        'age': random.randint(1, 119),
+        'weight': round(random.uniform(30, 150), 1),
+        'height': round(random.uniform(1.2, 2.2), 2),
+        'income_lpa': round(random.uniform(0.5, 100), 2),
+        'smoker': random.random() < 0.3,
+        'city': random.choice(CITIES),
+        'occupation': random.choice(OCCUPATIONS),
+    }
+
+
+def edge_users():
+    # both sides of every age and bmi boundary
+    users = []
+    for age in (24, 25, 44, 45, 59, 60):
+        for weight in (78.03, 78.04, 86.7, 86.71):
+            for smoker in (False, True):
+                user = random_user()
+                user.update(age=age, weight=weight, height=1.7, smoker=smoker)
+                users.append(user)
+    return users
+
+
+def by_properties(users):
+    return pd.DataFrame([
+        {column: getattr(user, column) for column in FEATURE_COLUMNS}
+        for user in users
+    ])
+
+
+def golden_check():
+    rows = [random_user() for _ in range(20_000)] + edge_users()
+    expected = by_properties([UserInput(**row) for row in rows])
+    actual = derive_features(pd.DataFrame(rows))
+    for column in FEATURE_COLUMNS:
+        assert list(actual[column]) == list(expected[column]), column
+    print(f"golden check: {len(rows)} rows identical to the UserInput properties")
+
+
+def measure(name, derive, rows):
+    repeat = max(1, 100_000 // len(rows))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        derive(rows)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {len(rows):>7} rows | {len(rows) * repeat / elapsed:12.0f} rows/s")
+
+
+def main():
+    golden_check()
+    for size in (1, 1_000, 100_000):
+        rows = [random_user() for _ in range(size)]
+        users = [UserInput(**row) for row in rows]
+        frame = pd.DataFrame(rows)
+        measure("properties", by_properties, users)
+        measure("derive_features", derive_features, frame)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Micro-batched /predict throughput per inference mode and worker count.
+
+Thread workers share one GIL, process workers each get a core, so only
+process mode should scale with --workers. Run from the `fastapi-ml-api`
+directory, on a machine with at least as many cores as workers:
+
+    python -m benchmarks.inference --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import time
+from registry import model_registry
+from batcher import MicroBatcher
+from inference import INFERENCE_PROCESS, INFERENCE_THREAD, InferenceExecutor
+from benchmarks.predict import ROW
+
+REQUESTS = 20_000
+CONCURRENCY = 512
+
+
+async def client(batcher, requests):
+    for _ in range(requests):
+        await batcher.predict(ROW)
+
+
+async def run(mode, workers):
+    executor = InferenceExecutor(model_registry, mode, workers)
+    await executor.start()
+
+    async def predict(rows):
+        return await executor.predict({field: [row[field] for row in rows] for field in rows[0]})
+
+    batcher = MicroBatcher(predict, max_in_flight=executor.workers)
+    await batcher.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(batcher, REQUESTS // CONCURRENCY) for _ in range(CONCURRENCY)
+    ))
+    elapsed = time.perf_counter() - start
+    await batcher.stop()
+    await executor.stop()
+    print(
+        f"{mode:<8} {workers:>2} workers | {batcher.rows / elapsed:8.1f} req/s | "
+        f"{batcher.rows / batcher.batches:6.1f} rows/batch"
+    )
+
+
+async def main(args):
+    print(f"{os.cpu_count()} cores, {CONCURRENCY} concurrent clients")
+    for mode in (INFERENCE_THREAD, INFERENCE_PROCESS):
+        for workers in args.workers:
+            await run(mode, workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    asyncio.run(main(parser.parse_args()))
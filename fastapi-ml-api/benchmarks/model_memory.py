@@ -0,0 +1,68 @@
+"""Memory of N worker processes holding the model, pickle vs. mmap'd joblib.
+
+Every worker loads the model through ModelRegistry and reports how much
+its proportional set size (PSS, shared pages split between the processes
+that map them) grew. Run from the `fastapi-ml-api` directory:
+
+    python -m benchmarks.model_memory --workers 8
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from registry import MODEL_PATH, ModelRegistry, convert_artifact
+
+
+def pss() -> int:
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def worker(path, loaded, done):
+    import sklearn.ensemble  # noqa: F401  imports are not the model
+    before = pss()
+    registry = ModelRegistry(path)
+    registry.warmup()
+    loaded.put((registry.active.load_seconds, before))
+    # hold the model until every worker has loaded, then measure
+    done.wait()
+    loaded.put(pss() - before)
+
+
+def run(path, workers):
+    context = multiprocessing.get_context('spawn')
+    loaded, done = context.Queue(), context.Event()
+    processes = [
+        context.Process(target=worker, args=(path, loaded, done))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    load_seconds = [loaded.get()[0] for _ in processes]
+    time.sleep(0.5)
+    done.set()
+    growth = sum(loaded.get() for _ in processes)
+    for process in processes:
+        process.join()
+    print(
+        f"{os.path.basename(path):<13} {workers} workers | "
+        f"load {max(load_seconds) * 1000:7.1f} ms | "
+        f"model PSS {growth / 1e6:7.2f} MB total"
+    )
+
+
+def main(args):
+    joblib_path = os.path.join(tempfile.mkdtemp(), 'model.joblib')
+    convert_artifact(MODEL_PATH, joblib_path)
+    for path in (MODEL_PATH, joblib_path):
+        run(path, args.workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=8)
+    main(parser.parse_args())
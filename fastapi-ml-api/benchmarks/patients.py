@@ -0,0 +1,135 @@
+"""patients.json vs. the log and SQLite patient stores at 1M patients.
+
+Measures opening the store (loading the JSON / replaying the log), a
+lookup by id, writing one patient, which for patients.json means
+rewriting the whole file, and the top 10 patients by bmi as /sort
+reads them. The log store builds its index on the first sorted read,
+shown separately. Afterwards, patients are edited the way /edit does it
+and the bmi index is checked against a full sort. Run from the
+`fastapi-ml-api` directory:
+
+    python -m benchmarks.patients [patients]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from patient_store import LogPatientStore, SqlitePatientStore
+
+PATIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+LOOKUPS = 10_000
+WRITES = 200
+TOP_K = 10
+SORTS = 100
+EDITS = 100
+CITIES = ['Mumbai', 'Delhi', 'Pune', 'Jaipur', 'Kolkata']
+
+
+def random_patient():
+    height = round(random.uniform(1.4, 2.0), 2)
+    weight = round(random.uniform(40, 120), 1)
+    bmi = round(weight / height ** 2, 2)
+    return {
+        'name': f"Patient {random.randrange(10**6)}",
+        'city': random.choice(CITIES),
+        'age': random.randint(1, 119),
+        'gender': random.choice(['male', 'female', 'others']),
+        'height': height,
+        'weight': weight,
+        'bmi': bmi,
+        'verdict': 'Normal' if bmi < 25 else 'Obese',
+    }
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(name, open_s, lookup_s, write_s, index_s, top_s):
+    print(
+        f"{name:<12} | open {open_s:7.2f} s | lookup {lookup_s * 1e6:8.1f} us | "
+        f"write {write_s * 1e3:9.3f} ms | index {index_s:5.2f} s | "
+        f"top {TOP_K} {top_s * 1e3:8.3f} ms"
+    )
+
+
+def bench_json(path, patients, ids):
+    with open(path, 'w') as f:
+        json.dump(patients, f)
+
+    def load():
+        with open(path) as f:
+            return json.load(f)
+
+    def save():
+        data = load()
+        data[random.choice(ids)] = random_patient()
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+    def top():
+        return sorted(load().values(), key=lambda x: x.get('bmi', 0), reverse=True)[:TOP_K]
+
+    # every request of main.py loaded the whole file, lookups included
+    open_s = timed(load)
+    report("json", open_s, open_s, timed(save, 3), 0, timed(top))
+
+
+def bench_store(name, make, patients, ids):
+    store = make()
+    store.put_many(patients.items())
+    store.close()
+    start = time.perf_counter()
+    store = make()
+    open_s = time.perf_counter() - start
+    lookups = random.choices(ids, k=LOOKUPS)
+    lookup_s = timed(lambda: store.get(lookups.pop()), LOOKUPS)
+
+    def top():
+        return list(store.sorted_items('bmi', descending=True, limit=TOP_K))
+
+    index_s = timed(top)
+    # writes keep the index up to date from here on
+    write_s = timed(lambda: store.put(random.choice(ids), random_patient()), WRITES)
+    top_s = timed(top, SORTS)
+    check_index(name, store, ids)
+    store.close()
+    report(name, open_s, lookup_s, write_s, index_s, top_s)
+
+
+def check_index(name, store, ids):
+    # get, change the record, put it back, with new highs and lows
+    for n, patient_id in enumerate(random.sample(ids, EDITS)):
+        record = store.get(patient_id)
+        record['bmi'] = [1000.0, 0.0][n] if n < 2 else round(random.uniform(10, 60), 2)
+        store.put(patient_id, record)
+    indexed = [patient_id for patient_id, _ in store.sorted_items('bmi')]
+    expected = [
+        patient_id for patient_id, _ in
+        sorted(store.items(), key=lambda item: (item[1].get('bmi', 0), item[0]))
+    ]
+    if indexed != expected:
+        raise AssertionError(f"{name}: the bmi index doesn't match a full sort after edits")
+    descending = [patient_id for patient_id, _ in store.sorted_items('bmi', descending=True)]
+    if descending != expected[::-1]:
+        raise AssertionError(f"{name}: the descending bmi index doesn't match a full sort")
+
+
+def main():
+    patients = {f"P{i:07d}": random_patient() for i in range(PATIENTS)}
+    ids = list(patients)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'patients')
+        bench_json(path + '.json', patients, ids)
+        bench_store("log", lambda: LogPatientStore(path + '.log', fsync=False), patients, ids)
+        bench_store("log, fsync", lambda: LogPatientStore(path + '.log', fsync=True), patients, ids)
+        bench_store("sqlite", lambda: SqlitePatientStore(path + '.db'), patients, ids)
+
+
+if __name__ == "__main__":
+    main()
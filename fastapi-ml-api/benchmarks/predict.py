@@ -0,0 +1,68 @@
+"""Throughput and latency of /predict, one model.predict per request vs.
+the micro-batcher, at several levels of concurrency.
+
+The per-request path predicts each row on its own in the inference
+thread pool, like the old sync handler did in Starlette's. Run from the
+`fastapi-ml-api` directory:
+
+    python -m benchmarks.predict
+"""
+import asyncio
+import statistics
+import time
+from app import executor, predict_rows
+from batcher import MicroBatcher
+
+REQUESTS = 2_000
+ROW = {
+    'age': 30,
+    'weight': 70.0,
+    'height': 1.7,
+    'income_lpa': 12.0,
+    'smoker': False,
+    'city': 'Mumbai',
+    'occupation': 'private_job',
+}
+
+
+async def per_request(row):
+    return (await predict_rows([row]))[0]
+
+
+async def client(predict, requests, latencies):
+    for _ in range(requests):
+        start = time.perf_counter()
+        await predict(ROW)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(name, predict, concurrency):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(predict, REQUESTS // concurrency, latencies)
+        for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<14} {concurrency:>4} concurrent | "
+        f"{len(latencies) / elapsed:8.1f} req/s | "
+        f"p50 {quantiles[49] * 1000:7.2f} ms | "
+        f"p99 {quantiles[98] * 1000:7.2f} ms"
+    )
+
+
+async def main():
+    await executor.start()
+    for concurrency in (1, 16, 64, 256):
+        await run("per request", per_request, concurrency)
+        batcher = MicroBatcher(predict_rows, max_in_flight=executor.workers)
+        await batcher.start()
+        await run("micro-batched", batcher.predict, concurrency)
+        await batcher.stop()
+    await executor.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
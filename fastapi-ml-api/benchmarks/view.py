@@ -0,0 +1,120 @@
+"""/view streamed from the store vs. the whole dict in one JSON response.
+
+For each store and dataset size, measures the time to the first byte,
+the time to the last one, and the peak memory allocated while answering
+(tracemalloc, in a separate run). The store itself is loaded and its id
+index built before measuring. First checks that the streamed bodies are
+valid JSON at chunk boundaries. Run from the `fastapi-ml-api` directory:
+
+    python -m benchmarks.view [patients ...]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import main
+from patient_store import LogPatientStore, SqlitePatientStore
+from benchmarks.patients import random_patient
+
+SIZES = [int(size) for size in sys.argv[1:]] or [100_000, 500_000]
+
+
+async def get(app, path, body=None):
+    # appends the response body to `body` if given
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '', 'headers': [],
+        'client': ('bench', 1), 'server': ('bench', 80),
+    }
+    disconnected = asyncio.Event()
+    start = time.perf_counter()
+    first = None
+    size = 0
+
+    async def receive():
+        # the body is empty, then the client stays connected
+        if not disconnected.is_set():
+            disconnected.set()
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal first, size
+        if message['type'] == 'http.response.body':
+            first = first or time.perf_counter()
+            size += len(message.get('body', b''))
+            if body is not None:
+                body.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return first - start, time.perf_counter() - start, size
+
+
+async def legacy_view(scope, receive, send):
+    # what /view did: the whole dict through jsonable_encoder in one body
+    response = JSONResponse(jsonable_encoder(dict(main.store.items())))
+    await response(scope, receive, send)
+
+
+def peak_memory(app):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    asyncio.run(get(app, '/view'))
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+
+def report(name, patients, app):
+    ttfb, total, size = asyncio.run(get(app, '/view'))
+    print(
+        f"{name:<16} | {patients:>9,} patients | ttfb {ttfb * 1e3:9.1f} ms | "
+        f"total {total:6.2f} s | {size / 1e6:6.1f} MB | peak {peak_memory(app) / 1e6:7.1f} MB"
+    )
+
+
+def check_json(directory):
+    # no part count, exactly one full chunk or one past it may leave a
+    # dangling separator
+    chunk = main.STREAM_CHUNK
+    for parts in (0, 1, chunk, chunk + 1, 2 * chunk):
+        if json.loads(''.join(main.stream(map(str, range(parts)), '[', ',', ']'))) != list(range(parts)):
+            raise AssertionError(f"stream() of {parts} parts isn't the JSON array")
+    main.store = LogPatientStore(os.path.join(directory, 'check.log'), fsync=False)
+    main.store.put_many([(f"P{i:07d}", random_patient()) for i in range(chunk)])
+    for path in ('/view', '/view?fields=bmi,city', '/sort?sort_by=bmi'):
+        body = []
+        asyncio.run(get(main.app, path, body))
+        if len(json.loads(b''.join(body))) != chunk:
+            raise AssertionError(f"{path} of {chunk} patients isn't valid JSON")
+    main.store.close()
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        check_json(directory)
+        for patients in SIZES:
+            records = [(f"P{i:07d}", random_patient()) for i in range(patients)]
+            for kind, make in (
+                ("log", lambda: LogPatientStore(os.path.join(directory, f'{patients}.log'), fsync=False)),
+                ("sqlite", lambda: SqlitePatientStore(os.path.join(directory, f'{patients}.db'))),
+            ):
+                main.store = make()
+                main.store.put_many(records)
+                # builds the log store's id index
+                list(main.store.scan(limit=1))
+                report(f"{kind}, before", patients, legacy_view)
+                report(f"{kind}, streamed", patients, main.app)
+                main.store.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import numpy as np
+from features import FEATURE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# rows kept in each worker's LRU, 0 turns the cache off
+CACHE_SIZE = int(os.getenv("ML_API_CACHE_SIZE", "100000"))
+# seconds an entry stays valid, 0 keeps it until it is evicted
+CACHE_TTL = float(os.getenv("ML_API_CACHE_TTL", "3600"))
+# float features are rounded to a multiple of these steps before both the
+# cache lookup and the prediction, so nearby inputs share an entry; 0 keeps
+# them exact. Rounding bmi to 0.1 changes what the model sees, only turn it
+# on if that is acceptable for the model.
+BMI_STEP = float(os.getenv("ML_API_CACHE_BMI_STEP", "0"))
+INCOME_STEP = float(os.getenv("ML_API_CACHE_INCOME_STEP", "0"))
+# a Redis tier shared by all workers, checked on local misses
+REDIS_URL = os.getenv("ML_API_CACHE_REDIS_URL")
+REDIS_PREFIX = b"ml-api:prediction:"
+
+BMI_COLUMN = FEATURE_COLUMNS.index('bmi')
+INCOME_COLUMN = FEATURE_COLUMNS.index('income_lpa')
+
+
+class PredictionCache:
+    """Predictions keyed on the encoded feature vector and model version.
+
+    The key is the row of `encode_features` output, so every input that
+    derives to the same features shares an entry. The model version's
+    artifact digest is part of the key: a new model never sees the old
+    one's entries, and the local LRU is dropped when the version changes.
+    """
+
+    def __init__(
+        self,
+        size: int = CACHE_SIZE,
+        ttl: float = CACHE_TTL,
+        bmi_step: float = BMI_STEP,
+        income_step: float = INCOME_STEP,
+        redis_url: Optional[str] = REDIS_URL,
+    ):
+        self.size = size
+        self.ttl = ttl
+        self.steps = {BMI_COLUMN: bmi_step, INCOME_COLUMN: income_step}
+        self.redis_url = redis_url
+        self.redis = None
+        self.entries: 'OrderedDict[bytes, tuple]' = OrderedDict()
+        self.digest: Optional[str] = None
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    async def start(self):
+        if self.enabled and self.redis_url:
+            # only needed for the shared tier
+            from redis import asyncio as aioredis
+
+            self.redis = aioredis.from_url(self.redis_url)
+
+    async def stop(self):
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    def quantize(self, codes: np.ndarray) -> np.ndarray:
+        for column, step in self.steps.items():
+            if step > 0:
+                codes[:, column] = np.round(codes[:, column] / step) * step
+        return codes
+
+    def _keys(self, digest: str, codes: np.ndarray) -> List[bytes]:
+        if digest != self.digest:
+            self.entries.clear()
+            self.digest = digest
+        prefix = digest.encode()
+        return [prefix + row.tobytes() for row in codes]
+
+    async def get_many(self, digest: str, codes: np.ndarray) -> List[Optional[Any]]:
+        """The cached prediction of every row, None where there is none."""
+        keys = self._keys(digest, codes)
+        now = time.monotonic()
+        results: List[Optional[Any]] = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is not None and (not self.ttl or entry[0] > now):
+                self.entries.move_to_end(key)
+                results[i] = entry[1]
+            else:
+                missing.append(i)
+        self.hits += len(keys) - len(missing)
+        if missing and self.redis is not None:
+            try:
+                values = await self.redis.mget([REDIS_PREFIX + keys[i] for i in missing])
+            except Exception:
+                # the shared tier is an optimisation, carry on without it
+                logger.exception("prediction cache: redis lookup failed")
+                values = [None] * len(missing)
+            still_missing = []
+            for i, value in zip(missing, values):
+                if value is None:
+                    still_missing.append(i)
+                else:
+                    results[i] = value.decode()
+                    self._put(keys[i], results[i], now)
+            self.redis_hits += len(missing) - len(still_missing)
+            missing = still_missing
+        self.misses += len(missing)
+        return results
+
+    async def set_many(self, digest: str, codes: np.ndarray, predictions: List[Any]):
+        if digest != self.digest:
+            # a newer version was seen while this batch ran
+            return
+        keys = self._keys(digest, codes)
+        now = time.monotonic()
+        for key, prediction in zip(keys, predictions):
+            self._put(key, prediction, now)
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key, prediction in zip(keys, predictions):
+                        pipe.set(REDIS_PREFIX + key, str(prediction), ex=int(self.ttl) or None)
+                    await pipe.execute()
+            except Exception:
+                logger.exception("prediction cache: redis store failed")
+
+    def _put(self, key: bytes, prediction: Any, now: float):
+        self.entries[key] = (now + self.ttl, prediction)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.redis_hits) / lookups if lookups else None,
+        }
+
+
+prediction_cache = PredictionCache()
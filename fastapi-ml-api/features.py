@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+tier_1_cities = ["Mumbai", "Delhi", "Bangalore", "Chennai", "Kolkata", "Hyderabad", "Pune"]
+tier_2_cities = [
+    "Jaipur", "Chandigarh", "Indore", "Lucknow", "Patna", "Ranchi", "Visakhapatnam", "Coimbatore",
+    "Bhopal", "Nagpur", "Vadodara", "Surat", "Rajkot", "Jodhpur", "Raipur", "Amritsar", "Varanasi",
+    "Agra", "Dehradun", "Mysore", "Jabalpur", "Guwahati", "Thiruvananthapuram", "Ludhiana", "Nashik",
+    "Allahabad", "Udaipur", "Aurangabad", "Hubli", "Belgaum", "Salem", "Vijayawada", "Tiruchirappalli",
+    "Bhavnagar", "Gwalior", "Dhanbad", "Bareilly", "Aligarh", "Gaya", "Kozhikode", "Warangal",
+    "Kolhapur", "Bilaspur", "Jalandhar", "Noida", "Guntur", "Asansol", "Siliguri"
+]
+
+# every city that isn't listed is tier 3
+CITY_TIERS = {city: 2 for city in tier_2_cities} | {city: 1 for city in tier_1_cities}
+OTHER_CITY_TIER = 3
+# lookup table for whole columns: get_indexer gives -1 for unknown cities,
+# which picks the trailing OTHER_CITY_TIER
+CITY_INDEX = pd.Index(list(CITY_TIERS))
+CITY_TIER_TABLE = np.array(list(CITY_TIERS.values()) + [OTHER_CITY_TIER])
+
+# age < 25 is young, < 45 adult, < 60 middle aged, the rest senior
+AGE_BINS = np.array([25, 45, 60])
+AGE_GROUPS = np.array(['young', 'adult', 'middle_aged', 'senior'], dtype=object)
+# smokers with bmi > 30 are high risk, smokers or bmi > 27 medium
+RISK_LEVELS = np.array(['low', 'medium', 'high'], dtype=object)
+OCCUPATIONS = ('retired', 'freelancer', 'student', 'government_job',
+               'business_owner', 'unemployed', 'private_job')
+OCCUPATION_INDEX = pd.Index(OCCUPATIONS)
+OCCUPATION_TABLE = np.array(OCCUPATIONS, dtype=object)
+
+# the columns model.pkl was trained on, in order
+FEATURE_COLUMNS = ['bmi', 'age_group', 'lifestyle_risk', 'city_tier', 'income_lpa', 'occupation']
+
+
+def encode_features(users) -> np.ndarray:
+    """Model features as one float matrix, FEATURE_COLUMNS in order.
+
+    `users` maps UserInput field names to columns (a DataFrame or a dict
+    of lists). Categorical features are stored as indexes into their
+    lookup tables, so the matrix is cheap to copy to another process.
+    """
+    bmi = np.asarray(users['weight'], dtype=float) / np.asarray(users['height'], dtype=float) ** 2
+    smoker = np.asarray(users['smoker'], dtype=bool)
+    codes = np.empty((len(bmi), len(FEATURE_COLUMNS)))
+    codes[:, 0] = bmi
+    codes[:, 1] = np.searchsorted(AGE_BINS, np.asarray(users['age']), side='right')
+    # high risk implies medium, so the two conditions add up to the level
+    codes[:, 2] = (smoker | (bmi > 27)).astype(np.intp) + (smoker & (bmi > 30))
+    codes[:, 3] = CITY_TIER_TABLE[CITY_INDEX.get_indexer(users['city'])]
+    codes[:, 4] = users['income_lpa']
+    codes[:, 5] = OCCUPATION_INDEX.get_indexer(users['occupation'])
+    return codes
+
+
+def decode_features(codes: np.ndarray) -> pd.DataFrame:
+    """The DataFrame model.predict expects, from `encode_features` output."""
+    return pd.DataFrame({
+        'bmi': codes[:, 0],
+        'age_group': AGE_GROUPS[codes[:, 1].astype(np.intp)],
+        'lifestyle_risk': RISK_LEVELS[codes[:, 2].astype(np.intp)],
+        'city_tier': codes[:, 3].astype(np.int64),
+        'income_lpa': codes[:, 4],
+        'occupation': OCCUPATION_TABLE[codes[:, 5].astype(np.intp)]
+    }, columns=FEATURE_COLUMNS)
+
+
+def derive_features(users) -> pd.DataFrame:
+    """Model features for UserInput fields, one row or millions.
+
+    Gives the same values as the UserInput computed fields, but works on
+    whole columns instead of one object at a time.
+    """
+    return decode_features(encode_features(users))
@@ -0,0 +1,167 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, List, Optional, Set, Tuple
+import numpy as np
+from cache import PredictionCache
+from features import decode_features, encode_features
+from registry import ModelRegistry, ModelVersion
+
+# "inline": predict on the event loop, only sensible for tiny models
+# "thread": a thread pool, the model's Python parts still share one GIL
+# "process": a pool of processes, each loading the versions it is asked for
+INFERENCE_INLINE = "inline"
+INFERENCE_THREAD = "thread"
+INFERENCE_PROCESS = "process"
+INFERENCE_MODE = os.getenv("ML_API_INFERENCE", INFERENCE_THREAD)
+INFERENCE_WORKERS = int(os.getenv("ML_API_INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+
+# model versions a process pool worker has loaded, least recently used
+# first; enough for the active version, a shadow and the one just replaced.
+# Keyed by the digest too: a name alone may be reused for another artifact
+worker_versions: 'OrderedDict[Tuple[str, str, Optional[str]], ModelVersion]' = OrderedDict()
+WORKER_VERSIONS = 3
+
+
+def worker_version(name: str, path: str, digest: Optional[str]) -> ModelVersion:
+    key = (name, path, digest)
+    version = worker_versions.get(key)
+    if version is None:
+        version = ModelVersion(name, path)
+        version.warmup()
+        if digest is not None and version.digest != digest:
+            # the file was replaced after the server loaded it; predicting
+            # with it would put another model's answers under this digest
+            raise RuntimeError(f"{path} changed since model version {name} was loaded")
+        worker_versions[key] = version
+        while len(worker_versions) > WORKER_VERSIONS:
+            worker_versions.popitem(last=False)
+    worker_versions.move_to_end(key)
+    return version
+
+
+def init_worker(name: str, path: str, digest: Optional[str]):
+    worker_version(name, path, digest)
+
+
+def predict_in_worker(
+    name: str, path: str, digest: Optional[str], codes: np.ndarray
+) -> List[Any]:
+    return list(worker_version(name, path, digest).model.predict(decode_features(codes)))
+
+
+def worker_ready() -> bool:
+    return bool(worker_versions)
+
+
+def predict_codes(version: ModelVersion, codes: np.ndarray) -> List[Any]:
+    return list(version.model.predict(decode_features(codes)))
+
+
+class InferenceExecutor:
+    """Runs model.predict for batches of UserInput fields.
+
+    In process mode only the encoded feature matrix (48 bytes a row) and
+    the model version's name, path and digest go to the workers, and only the
+    predicted labels come back. Every batch is timed against the version
+    that scored it, and the registry's shadow version, if any, scores a
+    sample of batches after the callers have their results.
+    """
+
+    def __init__(
+        self,
+        registry: ModelRegistry,
+        mode: str = INFERENCE_MODE,
+        workers: int = INFERENCE_WORKERS,
+        cache: Optional[PredictionCache] = None,
+    ):
+        if mode not in (INFERENCE_INLINE, INFERENCE_THREAD, INFERENCE_PROCESS):
+            raise ValueError(f"unknown inference mode {mode!r}")
+        self.registry = registry
+        self.cache = cache if cache is not None and cache.enabled else None
+        self.mode = mode
+        self.workers = 1 if mode == INFERENCE_INLINE else workers
+        self.pool: Optional[Executor] = None
+        self.shadows: Set[asyncio.Task] = set()
+
+    async def start(self):
+        if self.mode == INFERENCE_THREAD:
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="inference")
+        elif self.mode == INFERENCE_PROCESS:
+            # spawn, not fork: the server already runs threads and a loop
+            self.pool = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(
+                    self.registry.active.name,
+                    self.registry.active.path,
+                    self.registry.active.digest,
+                ),
+            )
+            # start every worker and load its model before taking traffic
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(self.pool, worker_ready)
+                for _ in range(self.workers)
+            ))
+
+    async def stop(self):
+        await asyncio.gather(*self.shadows)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    async def _run(self, version: ModelVersion, codes: np.ndarray) -> List[Any]:
+        start = time.perf_counter()
+        if self.mode == INFERENCE_INLINE:
+            predictions = predict_codes(version, codes)
+        elif self.mode == INFERENCE_THREAD:
+            predictions = await asyncio.get_running_loop().run_in_executor(
+                self.pool, predict_codes, version, codes
+            )
+        else:
+            predictions = await asyncio.get_running_loop().run_in_executor(
+                self.pool, predict_in_worker, version.name, version.path, version.digest, codes
+            )
+        version.metrics.record(len(predictions), time.perf_counter() - start)
+        return predictions
+
+    async def _cached_run(self, version: ModelVersion, codes: np.ndarray) -> List[Any]:
+        # the model sees the quantized features too, so an entry holds what
+        # the model would have said for every input that maps to it
+        codes = self.cache.quantize(codes)
+        predictions = await self.cache.get_many(version.digest, codes)
+        missing = [i for i, prediction in enumerate(predictions) if prediction is None]
+        if missing:
+            fresh = await self._run(version, codes[missing])
+            for i, prediction in zip(missing, fresh):
+                predictions[i] = prediction
+            await self.cache.set_many(version.digest, codes[missing], fresh)
+        return predictions
+
+    async def _shadow(self, version: ModelVersion, codes: np.ndarray, reference: List[Any]):
+        try:
+            version.metrics.record_shadow(await self._run(version, codes), reference)
+        except Exception:
+            # a broken candidate must never affect live traffic
+            version.metrics.shadow_errors += 1
+
+    async def predict(self, users) -> List[Any]:
+        """Predictions for `users`, a DataFrame or a dict of columns."""
+        # read once, so a swap while this batch runs doesn't mix versions
+        version = self.registry.active
+        shadow = self.registry.sample_shadow()
+        codes = encode_features(users)
+        if self.cache is None or version.digest is None:
+            predictions = await self._run(version, codes)
+        else:
+            predictions = await self._cached_run(version, codes)
+        if shadow is not None and shadow is not version:
+            task = asyncio.create_task(self._shadow(shadow, codes, predictions))
+            self.shadows.add(task)
+            task.add_done_callback(self.shadows.discard)
+        return predictions
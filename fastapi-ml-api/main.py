@@ -1,11 +1,19 @@
-from fastapi import FastAPI, Path, HTTPException, Query
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, computed_field
+from fastapi import FastAPI, Path, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, computed_field
 from typing import Annotated, Literal, Optional
+from patient_store import open_store
 import json
 
 app = FastAPI()
 
+# every patient, see patient_store.py for the backends
+store = open_store()
+
+# patients per chunk of a streamed response
+STREAM_CHUNK = 1000
+
 class Patient(BaseModel):
 
     id: Annotated[str, Field(..., description='ID of the patient', examples=['P001'])]
@@ -43,17 +51,25 @@ class PatientUpdate(BaseModel):
     height: Annotated[Optional[float], Field(default=None, gt=0)]
     weight: Annotated[Optional[float], Field(default=None, gt=0)]
 
+# what /view can project on
+patient_fields = [field for field in (*Patient.model_fields, *Patient.model_computed_fields) if field != 'id']
+
+def stream(parts, start='', separator='', end=''):
+    # joins the parts STREAM_CHUNK at a time, each chunk is sent as soon as it is built;
+    # every chunk after the first starts with the separator, so none is left dangling
+    chunk = []
+    sent = False
+    for part in parts:
+        chunk.append(part)
+        if len(chunk) == STREAM_CHUNK:
+            yield (separator if sent else start) + separator.join(chunk)
+            chunk = []
+            sent = True
+    if chunk:
+        yield (separator if sent else start) + separator.join(chunk) + end
+    else:
+        yield ('' if sent else start) + end
 
-def load_data():
-    with open('patients.json', 'r') as f:
-        data = json.load(f)
-
-    return data
-
-def save_data(data):
-    with open('patients.json', 'w') as f:
-        json.dump(data, f)
-        
 
 @app.get("/")
 def hello():
@@ -64,22 +80,38 @@ def about():
     return {'message': 'A fully functional API to manage your patient records'}
 
 @app.get('/view')
-def view():
-    data = load_data()
+def view(request: Request, after: Optional[str] = Query(None, description='Start after this patient ID, the last one of the previous page'), limit: Optional[int] = Query(None, ge=1, description='Return at most this many patients'), fields: Optional[str] = Query(None, description='Comma separated fields to return, all by default')):
+
+    projection = fields.split(',') if fields is not None else None
+
+    if projection is not None and not set(projection) <= set(patient_fields):
+        raise HTTPException(status_code=400, detail=f'Invalid field select from {patient_fields}')
 
-    return data
+    # patients in ID order, read from the store a page at a time
+    patients = store.scan(after=after, limit=limit)
+
+    if projection is not None:
+        patients = ((patient_id, {field: patient[field] for field in projection if field in patient}) for patient_id, patient in patients)
+
+    # one patient per line, with its ID, for clients that ask for NDJSON
+    if request.headers.get('accept', '').startswith('application/x-ndjson'):
+        lines = (json.dumps({'id': patient_id, **patient}) + '\n' for patient_id, patient in patients)
+        return StreamingResponse(stream(lines), media_type='application/x-ndjson')
+
+    # otherwise one JSON object of ID -> patient
+    members = (json.dumps(patient_id) + ':' + json.dumps(patient) for patient_id, patient in patients)
+    return StreamingResponse(stream(members, '{', ',', '}'), media_type='application/json')
 
 @app.get('/patient/{patient_id}')
 def view_patient(patient_id: str = Path(..., description='ID of the patient in the DB', example='P001')):
-    # load all the patients
-    data = load_data()
+    patient = store.get(patient_id)
 
-    if patient_id in data:
-        return data[patient_id]
+    if patient is not None:
+        return patient
     raise HTTPException(status_code=404, detail='Patient not found')
 
 @app.get('/sort')
-def sort_patients(sort_by: str = Query(..., description='Sort on the basis of height, weight or bmi'), order: str = Query('asc', description='sort in asc or desc order')):
+def sort_patients(sort_by: str = Query(..., description='Sort on the basis of height, weight or bmi'), order: str = Query('asc', description='sort in asc or desc order'), limit: Optional[int] = Query(None, ge=1, description='Return at most this many patients'), offset: int = Query(0, ge=0, description='Skip this many patients first')):
 
     valid_fields = ['height', 'weight', 'bmi']
 
@@ -89,29 +121,25 @@ def sort_patients(sort_by: str = Query(..., description='Sort on the basis of he
     if order not in ['asc', 'desc']:
         raise HTTPException(status_code=400, detail='Invalid order select between asc and desc')
     
-    data = load_data()
-
     sort_order = True if order=='desc' else False
 
-    sorted_data = sorted(data.values(), key=lambda x: x.get(sort_by, 0), reverse=sort_order)
+    # read in order from the store's index instead of sorting everyone
+    sorted_data = store.sorted_items(sort_by, descending=sort_order, offset=offset, limit=limit)
 
-    return sorted_data
+    return StreamingResponse(stream((json.dumps(patient) for _, patient in sorted_data), '[', ',', ']'), media_type='application/json')
 
 @app.post('/create')
 def create_patient(patient: Patient):
 
-    # load existing data
-    data = load_data()
+    # no other request may create the same id between the check and the write
+    with store.locked():
 
-    # check if the patient already exists
-    if patient.id in data:
-        raise HTTPException(status_code=400, detail='Patient already exists')
+        # check if the patient already exists
+        if patient.id in store:
+            raise HTTPException(status_code=400, detail='Patient already exists')
 
-    # new patient add to the database
-    data[patient.id] = patient.model_dump(exclude=['id'])
-
-    # save into the json file
-    save_data(data)
+        # new patient add to the database
+        store.put(patient.id, patient.model_dump(exclude=['id']))
 
     return JSONResponse(status_code=201, content={'message':'patient created successfully'})
 
@@ -119,44 +147,43 @@ def create_patient(patient: Patient):
 @app.put('/edit/{patient_id}')
 def update_patient(patient_id: str, patient_update: PatientUpdate):
 
-    data = load_data()
+    # read, merge and write back without losing a concurrent update
+    with store.locked():
 
-    if patient_id not in data:
-        raise HTTPException(status_code=404, detail='Patient not found')
-    
-    existing_patient_info = data[patient_id]
+        existing_patient_info = store.get(patient_id)
 
-    updated_patient_info = patient_update.model_dump(exclude_unset=True)
+        if existing_patient_info is None:
+            raise HTTPException(status_code=404, detail='Patient not found')
 
-    for key, value in updated_patient_info.items():
-        existing_patient_info[key] = value
+        updated_patient_info = patient_update.model_dump(exclude_unset=True)
 
-    #existing_patient_info -> pydantic object -> updated bmi + verdict
-    existing_patient_info['id'] = patient_id
-    patient_pydandic_obj = Patient(**existing_patient_info)
-    #-> pydantic object -> dict
-    existing_patient_info = patient_pydandic_obj.model_dump(exclude='id')
+        # merged into a new dict, the stored record only changes by store.put
+        existing_patient_info = {**existing_patient_info, **updated_patient_info}
 
-    # add this dict to data
-    data[patient_id] = existing_patient_info
+        #existing_patient_info -> pydantic object -> updated bmi + verdict
+        existing_patient_info['id'] = patient_id
+        try:
+            patient_pydandic_obj = Patient(**existing_patient_info)
+        except ValidationError as exc:
+            # e.g. an age PatientUpdate allows but Patient doesn't
+            raise RequestValidationError(exc.errors(include_url=False))
+        #-> pydantic object -> dict
+        existing_patient_info = patient_pydandic_obj.model_dump(exclude='id')
 
-    # save data
-    save_data(data)
+        # save the patient
+        store.put(patient_id, existing_patient_info)
 
     return JSONResponse(status_code=200, content={'message':'patient updated'})
 
 @app.delete('/delete/{patient_id}')
 def delete_patient(patient_id: str):
 
-    # load data
-    data = load_data()
+    with store.locked():
 
-    if patient_id not in data:
-        raise HTTPException(status_code=404, detail='Patient not found')
-    
-    del data[patient_id]
+        if patient_id not in store:
+            raise HTTPException(status_code=404, detail='Patient not found')
 
-    save_data(data)
+        store.delete(patient_id)
 
     return JSONResponse(status_code=200, content={'message':'patient deleted'})
 
@@ -0,0 +1,594 @@
+import fcntl
+import json
+import os
+import sqlite3
+import sys
+import threading
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# "log": an append-only JSON lines file replayed into a dict at startup
+# "sqlite": one row per patient in a SQLite database
+STORE_LOG = "log"
+STORE_SQLITE = "sqlite"
+PATIENT_STORE = os.getenv("PATIENT_STORE", STORE_LOG)
+PATIENT_STORE_PATH = os.getenv("PATIENT_STORE_PATH")
+DEFAULT_PATHS = {STORE_LOG: "patients.log", STORE_SQLITE: "patients.db"}
+# imported once into a new store, see open_store
+LEGACY_JSON = "patients.json"
+# fsync every write to the log; without it a crash of the machine (not just
+# the process) can lose the last writes
+FSYNC = os.getenv("PATIENT_STORE_FSYNC", "1") == "1"
+# the log is rewritten once it holds this many times more lines than patients
+COMPACT_RATIO = 2
+COMPACT_MIN_LINES = 1000
+# fields /sort can order by, each backed by an index
+SORT_FIELDS = ('height', 'weight', 'bmi')
+# the log store's index in id order, for scan()
+ID_ORDER = 'id'
+# entries per chunk of a log store index
+INDEX_CHUNK = 1000
+# patients read per step when streaming, per SQLite query or per hold of
+# the log store's lock
+READ_PAGE = 1000
+
+TRecord = Dict[str, object]
+
+
+class PatientStore:
+    """Patients by id, shared by every worker process.
+
+    Single operations are atomic. A read-modify-write (create if absent,
+    update) must run inside `locked()`, which also shuts out other
+    processes until it ends.
+    """
+
+    def get(self, patient_id: str) -> Optional[TRecord]:
+        raise NotImplementedError
+
+    def __contains__(self, patient_id: str) -> bool:
+        return self.get(patient_id) is not None
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def items(self) -> Iterator[Tuple[str, TRecord]]:
+        raise NotImplementedError
+
+    def put(self, patient_id: str, record: TRecord):
+        raise NotImplementedError
+
+    def put_many(self, records: Iterable[Tuple[str, TRecord]]):
+        raise NotImplementedError
+
+    def delete(self, patient_id: str):
+        raise NotImplementedError
+
+    def imported(self) -> bool:
+        """Whether the store went through open_store's one-time import."""
+        raise NotImplementedError
+
+    def import_records(self, records: Iterable[Tuple[str, TRecord]]):
+        """put_many that also marks the store imported, in the same write."""
+        raise NotImplementedError
+
+    def sorted_items(
+        self, field: str, descending: bool = False, offset: int = 0, limit: Optional[int] = None,
+    ) -> Iterator[Tuple[str, TRecord]]:
+        """Patients ordered by `field` then id, from an index, not a sort."""
+        raise NotImplementedError
+
+    def scan(self, after: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Tuple[str, TRecord]]:
+        """Patients in id order from the one after `after`, a page at a time."""
+        raise NotImplementedError
+
+    def locked(self):
+        """Context manager holding the store's write lock."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def sort_key(record: TRecord, field: str):
+    # a patient without the field sorts as 0, as /sort always did
+    return record.get(field, 0)
+
+
+def index_pair(field: str, patient_id: str, record: TRecord) -> Tuple[object, str]:
+    if field == ID_ORDER:
+        return patient_id, patient_id
+    return sort_key(record, field), patient_id
+
+
+class SortedIndex:
+    """(value, id) pairs kept in order.
+
+    The pairs live in sorted chunks of about INDEX_CHUNK entries, so an
+    insert or removal shifts one chunk instead of the whole list, and a
+    slice only touches the chunks it covers.
+    """
+
+    def __init__(self, pairs: Iterable[Tuple[object, str]]):
+        pairs = sorted(pairs)
+        self.chunks = [pairs[i:i + INDEX_CHUNK] for i in range(0, len(pairs), INDEX_CHUNK)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.size = len(pairs)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, pair: Tuple[object, str]):
+        self.size += 1
+        if not self.chunks:
+            self.chunks.append([pair])
+            self.maxes.append(pair)
+            return
+        i = min(bisect_left(self.maxes, pair), len(self.chunks) - 1)
+        chunk = self.chunks[i]
+        insort(chunk, pair)
+        self.maxes[i] = chunk[-1]
+        if len(chunk) > 2 * INDEX_CHUNK:
+            self.chunks[i:i + 1] = [chunk[:INDEX_CHUNK], chunk[INDEX_CHUNK:]]
+            self.maxes[i:i + 1] = [chunk[INDEX_CHUNK - 1], chunk[-1]]
+
+    def remove(self, pair: Tuple[object, str]):
+        i = bisect_left(self.maxes, pair)
+        chunk = self.chunks[i]
+        del chunk[bisect_left(chunk, pair)]
+        self.size -= 1
+        if chunk:
+            self.maxes[i] = chunk[-1]
+        else:
+            del self.chunks[i]
+            del self.maxes[i]
+
+    def rank(self, pair: Tuple[object, str]) -> int:
+        """How many pairs sort before or equal to `pair`."""
+        i = bisect_right(self.maxes, pair)
+        position = sum(len(chunk) for chunk in self.chunks[:i])
+        if i < len(self.chunks):
+            position += bisect_right(self.chunks[i], pair)
+        return position
+
+    def slice(self, start: int, stop: int, descending: bool = False) -> List[Tuple[object, str]]:
+        """Pairs `start` to `stop` in ascending or descending order."""
+        pairs = []
+        position = 0
+        # walk from the end a descending slice starts at
+        for chunk in reversed(self.chunks) if descending else self.chunks:
+            if position >= stop:
+                break
+            if position + len(chunk) > start:
+                if descending:
+                    chunk = chunk[::-1]
+                pairs.extend(chunk[max(start - position, 0):stop - position])
+            position += len(chunk)
+        return pairs
+
+
+class LogPatientStore(PatientStore):
+    """Append-only log of puts and deletes, with every patient in a dict.
+
+    A write appends one line under an exclusive flock. Before reading,
+    each process replays the lines other processes appended since its last
+    look, so every worker serves the same data. A half-written last line
+    left by a crash is ignored, then cut off by the next writer. Once
+    most lines are stale, the log is rewritten to a temporary file and
+    renamed over the old one; the other processes notice the new inode
+    and reload. The indexes, per sort field and by id for scan(), are
+    built on first use and then kept up to date by every applied line.
+    An import ends with an "imported" line written together with its puts.
+    Records go in and come out as copies: one changed by a caller must not
+    change the dict, or the index entries, it was stored as.
+    """
+
+    def __init__(self, path: str, fsync: bool = FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = open(path + '.lock', 'a')
+        self.records: Dict[str, TRecord] = {}
+        with self.lock:
+            self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'a+b')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.records = {}
+        self.indexes: Dict[str, SortedIndex] = {}
+        self.import_done = False
+        self.offset = 0
+        self.lines = 0
+        self._catch_up()
+
+    def _catch_up(self):
+        try:
+            replaced = os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            replaced = False
+        if replaced:
+            self.file.close()
+            self._open()
+            return
+        size = os.fstat(self.file.fileno()).st_size
+        if size <= self.offset:
+            return
+        self.file.seek(self.offset)
+        data = self.file.read(size - self.offset)
+        end = data.rfind(b'\n') + 1
+        if end:
+            # one parse for the whole batch of lines, much faster at startup
+            for entry in json.loads(b'[' + data[:end - 1].replace(b'\n', b',') + b']'):
+                self._apply(entry)
+        self.offset += end
+
+    def _apply(self, entry: dict):
+        self.lines += 1
+        if entry['op'] == 'imported':
+            self.import_done = True
+            return
+        patient_id = entry['id']
+        if entry['op'] == 'put':
+            old = self.records.get(patient_id)
+            self.records[patient_id] = entry['data']
+        else:
+            old = self.records.pop(patient_id, None)
+        for field, index in self.indexes.items():
+            if old is not None:
+                index.remove(index_pair(field, patient_id, old))
+            if entry['op'] == 'put':
+                index.add(index_pair(field, patient_id, entry['data']))
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            if self.depth == 0:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            self.depth += 1
+            try:
+                if self.depth == 1:
+                    self._catch_up()
+                yield self
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _append(self, entries):
+        data = b''.join(
+            json.dumps(entry, separators=(',', ':')).encode() + b'\n'
+            for entry in entries
+        )
+        with self.locked():
+            if os.fstat(self.file.fileno()).st_size > self.offset:
+                # a writer crashed mid-line, drop its partial line
+                self.file.truncate(self.offset)
+            self.file.write(data)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.offset += len(data)
+            for entry in entries:
+                self._apply(entry)
+            if self.lines > COMPACT_MIN_LINES and self.lines > COMPACT_RATIO * len(self.records):
+                self.compact()
+
+    def compact(self):
+        with self.locked():
+            temp = self.path + '.tmp'
+            with open(temp, 'wb') as f:
+                for patient_id, record in self.records.items():
+                    f.write(json.dumps(
+                        {'op': 'put', 'id': patient_id, 'data': record},
+                        separators=(',', ':'),
+                    ).encode() + b'\n')
+                if self.import_done:
+                    f.write(b'{"op":"imported"}\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.path)
+            self.file.close()
+            self._open()
+
+    def get(self, patient_id: str) -> Optional[TRecord]:
+        with self.lock:
+            if self.depth == 0:
+                self._catch_up()
+            record = self.records.get(patient_id)
+            return dict(record) if record is not None else None
+
+    def __len__(self) -> int:
+        with self.lock:
+            if self.depth == 0:
+                self._catch_up()
+            return len(self.records)
+
+    def items(self) -> Iterator[Tuple[str, TRecord]]:
+        with self.lock:
+            if self.depth == 0:
+                self._catch_up()
+            # a snapshot, writes while iterating must not break the loop
+            return iter([(patient_id, dict(record)) for patient_id, record in self.records.items()])
+
+    def sorted_items(
+        self, field: str, descending: bool = False, offset: int = 0, limit: Optional[int] = None,
+    ) -> Iterator[Tuple[str, TRecord]]:
+        if field not in SORT_FIELDS:
+            raise ValueError(f"can't sort patients by {field!r}")
+        return self._sorted_pages(field, descending, offset, limit)
+
+    def _sorted_pages(
+        self, field: str, descending: bool, offset: int, limit: Optional[int],
+    ) -> Iterator[Tuple[str, TRecord]]:
+        after = None
+        while limit is None or limit > 0:
+            page = READ_PAGE if limit is None else min(READ_PAGE, limit)
+            # as in scan(), the lock is held while one page is copied out and
+            # the next page starts after the last pair, wherever writes moved it
+            with self.lock:
+                if self.depth == 0:
+                    self._catch_up()
+                index = self._index(field)
+                if after is None:
+                    start = offset
+                elif not descending:
+                    start = index.rank(after)
+                else:
+                    # skip the pairs above the last one, and it too if still there
+                    start = len(index) - index.rank(after)
+                    record = self.records.get(after[1])
+                    if record is not None and index_pair(field, after[1], record) == after:
+                        start += 1
+                pairs = index.slice(start, start + page, descending)
+                items = [(patient_id, dict(self.records[patient_id])) for _, patient_id in pairs]
+            yield from items
+            if len(items) < page:
+                return
+            after = pairs[-1]
+            if limit is not None:
+                limit -= len(items)
+
+    def scan(self, after: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Tuple[str, TRecord]]:
+        while limit is None or limit > 0:
+            page = READ_PAGE if limit is None else min(READ_PAGE, limit)
+            # the lock is only held while a page is copied out; the next
+            # page starts after the last id, wherever writes moved it
+            with self.lock:
+                if self.depth == 0:
+                    self._catch_up()
+                index = self._index(ID_ORDER)
+                start = index.rank((after, after)) if after is not None else 0
+                items = [
+                    (patient_id, dict(self.records[patient_id]))
+                    for _, patient_id in index.slice(start, start + page)
+                ]
+            yield from items
+            if len(items) < page:
+                return
+            after = items[-1][0]
+            if limit is not None:
+                limit -= len(items)
+
+    def _index(self, field: str) -> SortedIndex:
+        index = self.indexes.get(field)
+        if index is None:
+            index = self.indexes[field] = SortedIndex(
+                index_pair(field, patient_id, record)
+                for patient_id, record in self.records.items()
+            )
+        return index
+
+    def put(self, patient_id: str, record: TRecord):
+        self._append([{'op': 'put', 'id': patient_id, 'data': dict(record)}])
+
+    def put_many(self, records: Iterable[Tuple[str, TRecord]]):
+        self._append([
+            {'op': 'put', 'id': patient_id, 'data': dict(record)}
+            for patient_id, record in records
+        ])
+
+    def delete(self, patient_id: str):
+        self._append([{'op': 'del', 'id': patient_id}])
+
+    def imported(self) -> bool:
+        with self.lock:
+            if self.depth == 0:
+                self._catch_up()
+            return self.import_done
+
+    def import_records(self, records: Iterable[Tuple[str, TRecord]]):
+        # one write: after a crash either the mark is there or the import
+        # runs again, rewriting the same puts
+        self._append([
+            *({'op': 'put', 'id': patient_id, 'data': dict(record)} for patient_id, record in records),
+            {'op': 'imported'},
+        ])
+
+    def close(self):
+        self.file.close()
+        self.lock_file.close()
+
+
+class SqlitePatientStore(PatientStore):
+    """One row per patient; SQLite does the locking and crash recovery.
+
+    The record is kept as JSON next to the columns that are queried on
+    their own, each indexed together with the id for /sort.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.RLock()
+        self.depth = 0
+        # autocommit, transactions are opened explicitly in locked()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=5000")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS patients ("
+            "id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+            "height REAL, weight REAL, bmi REAL)"
+        )
+        for field in SORT_FIELDS:
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS patients_{field} ON patients ({field}, id)"
+            )
+        # store-wide flags, the import mark
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            if self.depth == 0:
+                # takes the write lock now, not at the first write
+                self.db.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.db.execute("ROLLBACK")
+                raise
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.db.execute("COMMIT")
+
+    def get(self, patient_id: str) -> Optional[TRecord]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data FROM patients WHERE id = ?", (patient_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT count(*) FROM patients").fetchone()[0]
+
+    def items(self) -> Iterator[Tuple[str, TRecord]]:
+        with self.lock:
+            rows = self.db.execute("SELECT id, data FROM patients").fetchall()
+        return ((patient_id, json.loads(data)) for patient_id, data in rows)
+
+    def sorted_items(
+        self, field: str, descending: bool = False, offset: int = 0, limit: Optional[int] = None,
+    ) -> Iterator[Tuple[str, TRecord]]:
+        if field not in SORT_FIELDS:
+            raise ValueError(f"can't sort patients by {field!r}")
+        order = "DESC" if descending else "ASC"
+        after = None
+        while limit is None or limit > 0:
+            page = READ_PAGE if limit is None else min(READ_PAGE, limit)
+            # the next page starts after the last row of this one, so only
+            # the first page pays for the offset
+            where = f"WHERE ({field}, id) {'<' if descending else '>'} (?, ?)" if after else ""
+            with self.lock:
+                rows = self.db.execute(
+                    f"SELECT {field}, id, data FROM patients {where} "
+                    f"ORDER BY {field} {order}, id {order} LIMIT ? OFFSET ?",
+                    (*(after or ()), page, offset),
+                ).fetchall()
+            for _, patient_id, data in rows:
+                yield patient_id, json.loads(data)
+            if len(rows) < page:
+                return
+            after = rows[-1][:2]
+            offset = 0
+            if limit is not None:
+                limit -= len(rows)
+
+    def scan(self, after: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Tuple[str, TRecord]]:
+        while limit is None or limit > 0:
+            page = READ_PAGE if limit is None else min(READ_PAGE, limit)
+            where = "WHERE id > ?" if after is not None else ""
+            with self.lock:
+                rows = self.db.execute(
+                    f"SELECT id, data FROM patients {where} ORDER BY id LIMIT ?",
+                    (*(() if after is None else (after,)), page),
+                ).fetchall()
+            for patient_id, data in rows:
+                yield patient_id, json.loads(data)
+            if len(rows) < page:
+                return
+            after = rows[-1][0]
+            if limit is not None:
+                limit -= len(rows)
+
+    def _row(self, patient_id: str, record: TRecord):
+        return (
+            patient_id, json.dumps(record, separators=(',', ':')),
+            *(sort_key(record, field) for field in SORT_FIELDS),
+        )
+
+    def put(self, patient_id: str, record: TRecord):
+        with self.locked():
+            self.db.execute(
+                "INSERT OR REPLACE INTO patients VALUES (?, ?, ?, ?, ?)",
+                self._row(patient_id, record),
+            )
+
+    def put_many(self, records: Iterable[Tuple[str, TRecord]]):
+        with self.locked():
+            self.db.executemany(
+                "INSERT OR REPLACE INTO patients VALUES (?, ?, ?, ?, ?)",
+                (self._row(patient_id, record) for patient_id, record in records),
+            )
+
+    def delete(self, patient_id: str):
+        with self.locked():
+            self.db.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+
+    def imported(self) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone() is not None
+
+    def import_records(self, records: Iterable[Tuple[str, TRecord]]):
+        # one transaction, rolled back as a whole if the import is cut short
+        with self.locked():
+            self.put_many(records)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('imported', '1')")
+
+    def close(self):
+        self.db.close()
+
+
+def open_store(
+    kind: str = PATIENT_STORE,
+    path: Optional[str] = PATIENT_STORE_PATH,
+    legacy_json: Optional[str] = LEGACY_JSON,
+) -> PatientStore:
+    path = path or DEFAULT_PATHS[kind]
+    if kind == STORE_LOG:
+        store = LogPatientStore(path)
+    elif kind == STORE_SQLITE:
+        store = SqlitePatientStore(path)
+    else:
+        raise ValueError(f"unknown patient store {kind!r}")
+    if legacy_json:
+        # decided under the write lock, so only one of the workers starting
+        # together imports; a store is marked once, even with nothing to
+        # import, so a patients.json showing up later isn't imported into it
+        with store.locked():
+            if not store.imported():
+                if os.path.exists(legacy_json):
+                    migrate_json(store, legacy_json)
+                else:
+                    store.import_records([])
+    return store
+
+
+def migrate_json(store: PatientStore, path: str):
+    """Copies a patients.json (id -> record) into the store in one write."""
+    with open(path) as f:
+        store.import_records(json.load(f).items())
+
+
+if __name__ == "__main__":
+    # python patient_store.py sqlite patients.db [patients.json]
+    store = open_store(sys.argv[1], sys.argv[2], legacy_json=None)
+    migrate_json(store, sys.argv[3] if len(sys.argv) > 3 else LEGACY_JSON)
+    store.close()
@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+import joblib
+from features import encode_features, decode_features
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.getenv("ML_API_MODEL_PATH", "model.pkl")
+MODEL_VERSION = os.getenv("ML_API_MODEL_VERSION", "v1")
+# .joblib artifacts are opened with this mmap_mode: their numpy arrays are
+# mapped read-only from the page cache, so every worker shares one copy
+MMAP_MODE = os.getenv("ML_API_MODEL_MMAP", "r") or None
+# when > 0, the active artifact is checked this often and a new version is
+# loaded and activated when its mtime changes; replace the file atomically
+# (write elsewhere, then os.replace) so a half-written model is never read
+WATCH_INTERVAL = float(os.getenv("ML_API_MODEL_WATCH_SECONDS", "0"))
+# latencies kept per version for the percentiles in /models
+LATENCY_WINDOW = 1000
+
+# any valid user, predicted once at warmup so the first request doesn't pay
+# for lazy initialisation inside the model
+WARMUP_USER = {
+    'age': [30], 'weight': [70.0], 'height': [1.7], 'income_lpa': [10.0],
+    'smoker': [False], 'city': ['Mumbai'], 'occupation': ['private_job'],
+}
+
+
+def load_artifact(path: str):
+    if path.endswith('.joblib'):
+        return joblib.load(path, mmap_mode=MMAP_MODE)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def convert_artifact(source: str, target: str):
+    """Re-saves a pickled model as a memory-mappable joblib artifact."""
+    joblib.dump(load_artifact(source), target + '.tmp')
+    os.replace(target + '.tmp', target)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes, 0 if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+class VersionMetrics:
+    def __init__(self):
+        self.batches = 0
+        self.rows = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        # rows scored in shadow and how many matched the active version
+        self.shadow_rows = 0
+        self.shadow_agreed = 0
+        self.shadow_errors = 0
+
+    def record(self, rows: int, seconds: float):
+        self.batches += 1
+        self.rows += rows
+        self.latencies.append(seconds)
+
+    def record_shadow(self, predictions: List[Any], reference: List[Any]):
+        self.shadow_rows += len(predictions)
+        self.shadow_agreed += sum(a == b for a, b in zip(predictions, reference))
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            'batches': self.batches,
+            'rows': self.rows,
+            'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+            'shadow_rows': self.shadow_rows,
+            'agreement': self.shadow_agreed / self.shadow_rows if self.shadow_rows else None,
+            'shadow_errors': self.shadow_errors,
+        }
+
+
+class ModelVersion:
+    """One model artifact, loaded on first use or up front with `warmup`."""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.lock = threading.Lock()
+        self._model = None
+        self.mtime: Optional[float] = None
+        # identifies the artifact's contents across workers and restarts
+        self.digest: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.load_rss: Optional[int] = None
+        self.metrics = VersionMetrics()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self.lock:
+                if self._model is None:
+                    self._load()
+        return self._model
+
+    def _load(self):
+        rss = current_rss()
+        start = time.perf_counter()
+        self.mtime = os.path.getmtime(self.path)
+        self.digest = file_digest(self.path)
+        model = load_artifact(self.path)
+        self.load_seconds = time.perf_counter() - start
+        self.load_rss = current_rss() - rss
+        self._model = model
+        logger.info(
+            "loaded %s from %s in %.3f s, rss +%.1f MB",
+            self.name, self.path, self.load_seconds, self.load_rss / 1e6,
+        )
+
+    def warmup(self):
+        self.model.predict(decode_features(encode_features(WARMUP_USER)))
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'digest': self.digest,
+            'loaded': self._model is not None,
+            'load_seconds': self.load_seconds,
+            'load_rss_bytes': self.load_rss,
+            **self.metrics.snapshot(),
+        }
+
+
+class ModelRegistry:
+    """The model versions this worker knows, one active and maybe a shadow.
+
+    Swapping is a single attribute assignment: a batch reads `active` once
+    and finishes on that version even if another one is activated while
+    it runs. A shadow version scores a sampled fraction of batches off the
+    request path, to compare it with the active one before promoting it.
+    """
+
+    def __init__(self, path: str = MODEL_PATH, version: str = MODEL_VERSION):
+        self.versions: Dict[str, ModelVersion] = {version: ModelVersion(version, path)}
+        self.active = self.versions[version]
+        self.shadow: Optional[ModelVersion] = None
+        self.shadow_rate = 0.0
+        # names handed out by next_name, never reused once removed
+        self.last_number = 1
+
+    @property
+    def model(self):
+        return self.active.model
+
+    @property
+    def path(self) -> str:
+        return self.active.path
+
+    def warmup(self):
+        self.active.warmup()
+
+    def add(self, name: str, path: str) -> ModelVersion:
+        """Loads and warms up a new version, blocking; run it in a thread."""
+        if name in self.versions:
+            raise ValueError(f"model version {name!r} already exists")
+        version = ModelVersion(name, path)
+        version.warmup()
+        self.versions[name] = version
+        return version
+
+    def activate(self, name: str):
+        self.active = self.versions[name]
+        if self.shadow is self.active:
+            self.set_shadow(None)
+
+    def set_shadow(self, name: Optional[str], rate: float = 0.0):
+        self.shadow = self.versions[name] if name is not None else None
+        self.shadow_rate = rate if name is not None else 0.0
+
+    def remove(self, name: str):
+        if self.versions[name] is self.active:
+            raise ValueError("the active model version can't be removed")
+        if self.versions[name] is self.shadow:
+            self.set_shadow(None)
+        del self.versions[name]
+
+    def sample_shadow(self) -> Optional[ModelVersion]:
+        shadow = self.shadow
+        if shadow is not None and random.random() < self.shadow_rate:
+            return shadow
+        return None
+
+    def next_name(self) -> str:
+        self.last_number += 1
+        while f"v{self.last_number}" in self.versions:
+            self.last_number += 1
+        return f"v{self.last_number}"
+
+    async def watch(self, interval: float = WATCH_INTERVAL):
+        # activates a new version whenever the active artifact is replaced
+        while True:
+            await asyncio.sleep(interval)
+            active = self.active
+            if active.mtime is None:
+                continue
+            try:
+                mtime = os.path.getmtime(active.path)
+            except OSError:
+                continue
+            if mtime == active.mtime:
+                continue
+            try:
+                version = await asyncio.to_thread(self.add, self.next_name(), active.path)
+            except Exception:
+                logger.exception("could not reload %s", active.path)
+                # don't retry until the file changes again
+                active.mtime = mtime
+                continue
+            self.activate(version.name)
+            logger.info("activated %s", version.name)
+            # the file is the source of truth here: to roll back, put the
+            # old artifact back and it gets loaded as the next version
+            if active is not self.shadow:
+                self.remove(active.name)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            # each worker process has a registry of its own
+            'pid': os.getpid(),
+            'active': self.active.name,
+            'shadow': self.shadow.name if self.shadow is not None else None,
+            'shadow_rate': self.shadow_rate,
+            'rss_bytes': current_rss(),
+            'versions': {name: version.info() for name, version in self.versions.items()},
+        }
+
+
+model_registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    # python registry.py model.pkl model.joblib
+    convert_artifact(sys.argv[1], sys.argv[2])
@@ -0,0 +1,80 @@
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, List, Sequence, Set, Tuple
+
+# handler(ctx, [args, ...]) -> [result, ...], one result per args tuple
+BatchHandler = Callable[[dict, Sequence[Tuple[Any, ...]]], Awaitable[Sequence[Any]]]
+
+
+class Batcher:
+    """Collects the calls of concurrently running jobs into batches.
+
+    A batch is handed to the handler once `size` calls are waiting, or
+    `wait` seconds after the first of them arrived, whichever is first.
+    """
+
+    def __init__(self, handler: BatchHandler, size: int, wait: float):
+        self.handler = handler
+        self.size = size
+        self.wait = wait
+        self.pending: List[Tuple[Tuple[Any, ...], asyncio.Future]] = []
+        self.timer = None
+        self.ctx = None
+        # handler calls in flight, kept so they aren't garbage collected
+        self.running: Set[asyncio.Task] = set()
+
+    async def submit(self, ctx: dict, args: Tuple[Any, ...]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((args, future))
+        # every job's ctx holds the worker's shared resources, any one will do
+        self.ctx = ctx
+        if len(self.pending) >= self.size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._run(self.ctx, batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run(self, ctx, batch):
+        # jobs that timed out or were aborted meanwhile are left out
+        batch = [(args, future) for args, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            results = await self.handler(ctx, [args for args, future in batch])
+        except Exception as exc:
+            # every job of the batch fails with the error; arq only retries
+            # jobs that raise Retry
+            for args, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (args, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+def batched(handler: BatchHandler, size: int, wait: float):
+    """An arq job function that runs `handler` on batches of its calls.
+
+    Each queued job still is one arq job with its own status and result,
+    but the worker handles up to `size` of them with one handler call.
+    Only jobs running at the same time are batched, so `max_jobs` must
+    be at least `size` for full batches.
+    """
+    batcher = Batcher(handler, size, wait)
+
+    @functools.wraps(handler)
+    async def job(ctx, *args):
+        return await batcher.submit(ctx, args)
+
+    return job
@@ -0,0 +1,76 @@
+import os
+from typing import Any, List, Optional, Sequence, Tuple
+from uuid import uuid4
+from arq.connections import ArqRedis
+from arq.constants import job_key_prefix, result_key_prefix
+from arq.jobs import serialize_job
+from arq.utils import timestamp_ms
+
+# jobs written per pipeline, bounds the size of one round trip
+ENQUEUE_CHUNK = int(os.getenv("ENQUEUE_CHUNK", "1000"))
+
+
+async def enqueue_many(
+    queue: ArqRedis,
+    function: str,
+    calls: Sequence[Tuple[Any, ...]],
+    job_ids: Optional[Sequence[Optional[str]]] = None,
+    queue_name: Optional[str] = None,
+) -> List[Tuple[str, bool]]:
+    """Enqueues `function(*args)` for every args tuple in `calls`.
+
+    Writes the same keys as `ArqRedis.enqueue_job`, but pipelined: one
+    round trip per ENQUEUE_CHUNK jobs, two when some have a job id.
+    A given job id is the idempotency key: the job is only created if no
+    job or result with that id exists yet, otherwise it's reported as a
+    duplicate. Returns (job id, created) per call, in order.
+    """
+    if job_ids is None:
+        job_ids = [None] * len(calls)
+    results: List[Tuple[str, bool]] = []
+    for start in range(0, len(calls), ENQUEUE_CHUNK):
+        results += await _enqueue_chunk(
+            queue, function,
+            calls[start:start + ENQUEUE_CHUNK],
+            job_ids[start:start + ENQUEUE_CHUNK],
+            queue_name or queue.default_queue_name,
+        )
+    return results
+
+
+async def _enqueue_chunk(queue, function, calls, job_ids, queue_name):
+    now = timestamp_ms()
+    expires_ms = queue.expires_extra_ms
+    ids = [job_id or uuid4().hex for job_id in job_ids]
+    payloads = [
+        serialize_job(function, args, {}, None, now, serializer=queue.job_serializer)
+        for args in calls
+    ]
+    created = [True] * len(ids)
+    leftovers = []
+    keyed = [i for i, job_id in enumerate(job_ids) if job_id]
+    if keyed:
+        # SET NX claims the id, so only one of concurrent callers creates
+        # the job; an existing result also makes it a duplicate, like
+        # enqueue_job's EXISTS check
+        async with queue.pipeline(transaction=False) as pipe:
+            for i in keyed:
+                pipe.set(job_key_prefix + ids[i], payloads[i], px=expires_ms, nx=True)
+                pipe.exists(result_key_prefix + ids[i])
+            replies = await pipe.execute()
+        for n, i in enumerate(keyed):
+            claimed, has_result = replies[2 * n], replies[2 * n + 1]
+            created[i] = bool(claimed) and not has_result
+            if claimed and has_result:
+                leftovers.append(job_key_prefix + ids[i])
+    async with queue.pipeline(transaction=True) as pipe:
+        for i, job_id in enumerate(job_ids):
+            if not job_id:
+                pipe.psetex(job_key_prefix + ids[i], expires_ms, payloads[i])
+        if leftovers:
+            pipe.delete(*leftovers)
+        scores = {ids[i]: now for i in range(len(ids)) if created[i]}
+        if scores:
+            pipe.zadd(queue_name, scores)
+        await pipe.execute()
+    return list(zip(ids, created))
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Sequence, Set
+from arq.connections import ArqRedis
+from arq.jobs import JobStatus
+from app.status import job_statuses
+
+logger = logging.getLogger(__name__)
+
+# the worker publishes a job's id here when it starts and when it ends
+JOB_EVENTS_CHANNEL = os.getenv("JOB_EVENTS_CHANNEL", "tasks:events")
+# seconds between keep-alive comments on an idle event stream
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# statuses after which a job doesn't change any more
+FINAL_STATUSES = (JobStatus.complete, JobStatus.not_found)
+
+
+async def publish_job_event(redis: ArqRedis, job_id: str):
+    await redis.publish(JOB_EVENTS_CHANNEL, job_id)
+
+
+class JobEvents:
+    """One subscription to JOB_EVENTS_CHANNEL, fanned out to the streams.
+
+    Every open event stream registers the jobs it follows and gets their
+    ids on a queue when the worker publishes them, so the app holds one
+    Redis connection for events however many streams are open.
+    """
+
+    def __init__(self):
+        self.listeners: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.pubsub = None
+        self.task = None
+
+    async def start(self, queue: ArqRedis):
+        self.pubsub = queue.pubsub()
+        await self.pubsub.subscribe(JOB_EVENTS_CHANNEL)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.pubsub is not None:
+            await self.pubsub.reset()
+
+    async def _run(self):
+        while True:
+            try:
+                async for message in self.pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    job_id = message['data'].decode()
+                    for listener in self.listeners.get(job_id, ()):
+                        listener.put_nowait(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # redis-py reconnects and resubscribes on the next read
+                logger.exception("job events: subscription failed, retrying")
+                await asyncio.sleep(1)
+
+    @contextmanager
+    def subscribe(self, job_ids: Sequence[str]):
+        updates: asyncio.Queue = asyncio.Queue()
+        for job_id in job_ids:
+            self.listeners[job_id].add(updates)
+        try:
+            yield updates
+        finally:
+            for job_id in job_ids:
+                self.listeners[job_id].discard(updates)
+                if not self.listeners[job_id]:
+                    del self.listeners[job_id]
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def job_event_stream(queue: ArqRedis, events: JobEvents, job_ids: Sequence[str]):
+    """Server-sent events with each job's status, then each change of it.
+
+    Ends with a `done` event once every job is complete or not found.
+    """
+    # subscribed before the first lookup, so no change is missed
+    with events.subscribe(job_ids) as updates:
+        last = {}
+        changed = list(job_ids)
+        while True:
+            for status in await job_statuses(queue, changed):
+                if status['status'] != last.get(status['job_id']):
+                    last[status['job_id']] = status['status']
+                    yield sse('status', status)
+            if all(status in FINAL_STATUSES for status in last.values()):
+                yield sse('done', {})
+                return
+            try:
+                job_id = await asyncio.wait_for(updates.get(), EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                changed = []
+                continue
+            # jobs that changed meanwhile are looked up in the same round trip
+            changed = {job_id}
+            while not updates.empty():
+                changed.add(updates.get_nowait())
+            changed = [job_id for job_id in changed if last[job_id] not in FINAL_STATUSES]
@@ -1,15 +1,64 @@
+import os
 import random
 import asyncio
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from contextlib import asynccontextmanager
+from typing import Annotated, List, Optional
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, Field
-from arq.connections import RedisSettings
-from arq.connections import ArqRedis, create_pool
-from arq.jobs import Job, JobStatus
+from redis.asyncio import BlockingConnectionPool
+from redis.exceptions import RedisError
+from arq.connections import ArqRedis, RedisSettings
+from arq.jobs import JobStatus
+from app.enqueue import enqueue_many
+from app.events import JobEvents, job_event_stream
+from app.status import MAX_STATUS_IDS, job_statuses
 
-app = FastAPI()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# connections shared by all requests; when they are all busy a request
+# waits up to REDIS_POOL_TIMEOUT seconds for one instead of opening more
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+# a connection idle for this many seconds is PINGed before it is reused,
+# so one dropped by Redis or the network is replaced, not failed on
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+
+# the worker connects to the same Redis
+REDIS_SETTINGS = RedisSettings.from_dsn(REDIS_URL)
+
+
+async def create_queue() -> ArqRedis:
+    pool = BlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    queue = ArqRedis(pool)
+    # fail at startup rather than on the first request
+    await queue.ping()
+    return queue
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.queue = await create_queue()
+    app.state.events = JobEvents()
+    await app.state.events.start(app.state.queue)
+    yield
+    await app.state.events.stop()
+    await app.state.queue.close(close_connection_pool=True)
+
+
+def get_queue(request: Request) -> ArqRedis:
+    return request.app.state.queue
+
+
+Queue = Annotated[ArqRedis, Depends(get_queue)]
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
@@ -17,11 +66,32 @@ class TaskModel(BaseModel):
     count: int = Field(
         title="How many tasks to generate? (1 to 100)", ge=1, le=100)
 
+class JobModel(BaseModel):
+    sleep_time: int = Field(title="Seconds the task sleeps", ge=1, le=10)
+    idempotency_key: Optional[str] = Field(
+        default=None, min_length=1, max_length=128,
+        title="Used as the job id; a job with the same key is only created once")
+
+class BulkTaskModel(BaseModel):
+    jobs: List[JobModel] = Field(
+        title="Tasks to create (1 to 10000)", min_length=1, max_length=10_000)
+
+class StatusModel(BaseModel):
+    job_ids: List[str] = Field(
+        title="Jobs to look up", min_length=1, max_length=MAX_STATUS_IDS)
+
 async def create_task(ctx, sleep_time: int):
     print(f"creating task with sleep_time  of { sleep_time}")
     await asyncio.sleep(sleep_time)
     return sleep_time
 
+async def create_tasks(ctx, calls):
+    # the batched create_task: one sleep for the whole batch
+    sleep_times = [sleep_time for sleep_time, in calls]
+    print(f"creating {len(sleep_times)} tasks with sleep_time of {max(sleep_times)}")
+    await asyncio.sleep(max(sleep_times))
+    return sleep_times
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse('home.html', {
@@ -30,28 +100,62 @@ async def index(request: Request):
         'max': 100,
     })
 
+@app.get("/health")
+async def health(queue: Queue):
+    try:
+        await queue.ping()
+    except RedisError:
+        raise HTTPException(status_code=503, detail="Redis is unavailable")
+    return {'redis': 'ok'}
+
 @app.get("/task/{job_id}")
-async def get_task(job_id: str):
-    queue: ArqRedis = await create_pool(RedisSettings())
-    job = Job(job_id=job_id, redis=queue)
-    print(f"job ----------------------- {job}")
-    status = await job.status()
-    result = await job.result()
-    return {
-        'job_id': job_id,
-        'status': status,
-        'result': result,
-    }
+async def get_task(job_id: str, queue: Queue):
+    # answers right away, poll again until the status is complete
+    statuses = await job_statuses(queue, [job_id])
+    return statuses[0]
+
+@app.post("/tasks/status")
+async def tasks_status(request: StatusModel, queue: Queue):
+    # all the jobs in one Redis round trip, for dashboards tracking many
+    return await job_statuses(queue, request.job_ids)
+
+@app.get("/tasks/events")
+async def tasks_events(request: Request, job_ids: str, queue: Queue):
+    """Streams the status of the comma separated jobs as server-sent events.
+
+    The worker publishes every start and end of a job, so a client learns
+    of each change without polling.
+    """
+    ids = [job_id for job_id in job_ids.split(',') if job_id]
+    if not 1 <= len(ids) <= MAX_STATUS_IDS:
+        raise HTTPException(status_code=422, detail=f"Give 1 to {MAX_STATUS_IDS} job ids")
+    return StreamingResponse(
+        job_event_stream(queue, request.app.state.events, ids),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache'},
+    )
 
 @app.post("/task", status_code=201)
-async def task(task: TaskModel):
-    queue: ArqRedis = await create_pool(RedisSettings())
-    task_ids: list = []
-    for i in range(task.count):
-        job = await queue.enqueue_job('create_task', random.randint(1, 10))
-        task_ids.append(job.job_id)
+async def task(task: TaskModel, queue: Queue):
+    # one pipelined round trip instead of one enqueue_job per task
+    jobs = await enqueue_many(
+        queue, 'create_task', [(random.randint(1, 10),) for i in range(task.count)])
     return {
         "queued": task.count,
-        "task_ids": task_ids,
+        "task_ids": [job_id for job_id, created in jobs],
+    }
+
+@app.post("/tasks", status_code=201)
+async def bulk_tasks(tasks: BulkTaskModel, queue: Queue):
+    jobs = await enqueue_many(
+        queue, 'create_task',
+        [(job.sleep_time,) for job in tasks.jobs],
+        [job.idempotency_key for job in tasks.jobs],
+    )
+    return {
+        "queued": sum(created for job_id, created in jobs),
+        "task_ids": [job_id for job_id, created in jobs],
+        # ids whose job already existed, nothing new was queued for them
+        "duplicates": [job_id for job_id, created in jobs if not created],
     }
 
@@ -4,27 +4,62 @@ document.addEventListener('DOMContentLoaded', (event) => {
     const form = document.getElementById('tasks_form');
     const tasks = document.getElementById('tasks');
 
-    function getTaskStatus(JobId) {
-        axios.get(`/task/${JobId}`)
-            .then(function(resp){
-                if (resp.data.status === 'complete' || resp.data.status == 'not_found') {
-                    const tableRow = `
-                    <tr>
-                      <td>${resp.data.job_id}</td>
-                      <td>${resp.data.status}</td>
-                      <td>${resp.data.result}</td>
-                    </tr>
-                    `;
-                    const newRow = document.getElementById('table-status').insertRow(1);
-                    newRow.innerHTML = tableRow;
-                    return false;
-                }
+    // without EventSource, jobs still running are all polled together
+    // with one request
+    const pendingJobs = new Set();
+    let polling = false;
+
+    function addTaskRow(job) {
+        const tableRow = `
+        <tr>
+          <td>${job.job_id}</td>
+          <td>${job.status}</td>
+          <td>${job.result}</td>
+        </tr>
+        `;
+        const newRow = document.getElementById('table-status').insertRow(1);
+        newRow.innerHTML = tableRow;
+    }
 
-                setTimeout(function(){
-                    getTaskStatus(resp.data.job_id);
-                }, 1000);
+    function pollTaskStatuses() {
+        if (pendingJobs.size === 0) {
+            polling = false;
+            return;
+        }
+        polling = true;
 
+        // the endpoint takes up to 1000 ids per call
+        axios.post('/tasks/status', {
+            job_ids: Array.from(pendingJobs).slice(0, 1000)
+        })
+        .then(function(resp){
+            resp.data.forEach(function(job){
+                if (job.status === 'complete' || job.status === 'not_found') {
+                    pendingJobs.delete(job.job_id);
+                    addTaskRow(job);
+                }
             });
+        })
+        .catch(function(error){
+            console.log(error);
+        })
+        .finally(function(){
+            setTimeout(pollTaskStatuses, 1000);
+        });
+    }
+
+    function followTasks(taskIds) {
+        // the server pushes each status change, one stream per batch
+        const source = new EventSource('/tasks/events?job_ids=' + taskIds.join(','));
+        source.addEventListener('status', function(evt){
+            const job = JSON.parse(evt.data);
+            if (job.status === 'complete' || job.status === 'not_found') {
+                addTaskRow(job);
+            }
+        });
+        source.addEventListener('done', function(){
+            source.close();
+        });
     }
 
     function createTasks(count) {
@@ -32,17 +67,18 @@ document.addEventListener('DOMContentLoaded', (event) => {
             count: count
         })
         .then(function(response){
-            const jobIds = response.data.task_ids;
-            let results = [];
+            if (window.EventSource) {
+                followTasks(response.data.task_ids);
+                return;
+            }
 
-            jobIds.forEach(function(item){
-              results.push(getTaskStatus(item));
+            response.data.task_ids.forEach(function(item){
+                pendingJobs.add(item);
             });
 
-            Promise.all(results)
-                .catch(function(error){
-                      console.log(error);
-                });
+            if (!polling) {
+                pollTaskStatuses();
+            }
         })
         .catch(function(error){
             console.log(error);
@@ -0,0 +1,45 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence
+from arq.connections import ArqRedis
+from arq.constants import in_progress_key_prefix, result_key_prefix
+from arq.jobs import JobStatus, deserialize_result
+from arq.utils import timestamp_ms
+
+# job ids per POST /tasks/status call
+MAX_STATUS_IDS = int(os.getenv("MAX_STATUS_IDS", "1000"))
+
+
+async def job_statuses(
+    queue: ArqRedis, job_ids: Sequence[str], queue_name: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """The status of every job, and its result once complete, without waiting.
+
+    Reads what `Job.status` and `Job.result_info` read, for all the jobs
+    in one pipelined round trip.
+    """
+    queue_name = queue_name or queue.default_queue_name
+    async with queue.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            pipe.get(result_key_prefix + job_id)
+            pipe.exists(in_progress_key_prefix + job_id)
+            pipe.zscore(queue_name, job_id)
+        replies = await pipe.execute()
+    now = timestamp_ms()
+    statuses = []
+    for n, job_id in enumerate(job_ids):
+        result, in_progress, score = replies[3 * n:3 * n + 3]
+        status = {'job_id': job_id, 'status': JobStatus.not_found, 'result': None}
+        if result is not None:
+            info = deserialize_result(result, deserializer=queue.job_deserializer)
+            status.update(
+                status=JobStatus.complete,
+                success=info.success,
+                # a failed job's result is the exception it raised
+                result=info.result if info.success else repr(info.result),
+            )
+        elif in_progress:
+            status['status'] = JobStatus.in_progress
+        elif score is not None:
+            status['status'] = JobStatus.deferred if score > now else JobStatus.queued
+        statuses.append(status)
+    return statuses
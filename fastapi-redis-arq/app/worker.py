@@ -1,18 +1,89 @@
-from arq.connections import RedisSettings
-from app.main import create_task
+import asyncio
+import functools
+import os
+from contextlib import AsyncExitStack
+from arq import func
+from app.batch import batched
+from app.events import publish_job_event
+from app.main import REDIS_SETTINGS, create_task, create_tasks
+
+# jobs one worker runs at the same time
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "10"))
+# jobs read from the queue per poll, prefetched up to this many; defaults
+# to WORKER_MAX_JOBS, lower it so several workers share a burst of jobs
+WORKER_QUEUE_READ_LIMIT = int(os.getenv("WORKER_QUEUE_READ_LIMIT", "0")) or None
+# seconds between polls of the queue while the worker is idle
+WORKER_POLL_DELAY = float(os.getenv("WORKER_POLL_DELAY", "0.5"))
+# at most this many jobs of a function at once, e.g. "create_task=5",
+# for functions that load a backend less than WORKER_MAX_JOBS allows
+FUNCTION_LIMITS = {
+    name: int(limit)
+    for name, limit in (
+        item.split('=') for item in os.getenv("FUNCTION_LIMITS", "").split(',') if item
+    )
+}
+# create_task jobs handled together by one create_tasks call, 1 turns
+# batching off; a batch waits at most CREATE_TASK_BATCH_WAIT seconds to fill
+CREATE_TASK_BATCH_SIZE = int(os.getenv("CREATE_TASK_BATCH_SIZE", "1"))
+CREATE_TASK_BATCH_WAIT = float(os.getenv("CREATE_TASK_BATCH_WAIT", "0.05"))
+
+# resources shared by all jobs, name -> factory of an async context
+# manager; each is entered once at startup, is ctx[name] in every job,
+# and is exited at shutdown, e.g. 'http': lambda: httpx.AsyncClient()
+RESOURCES: dict = {}
+
 
 async def startup(ctx):
-    pass
+    ctx['resources'] = stack = AsyncExitStack()
+    for name, factory in RESOURCES.items():
+        ctx[name] = await stack.enter_async_context(factory())
+    ctx['limits'] = {name: asyncio.Semaphore(limit) for name, limit in FUNCTION_LIMITS.items()}
 
 async def shutdown(ctx):
-    pass
+    await ctx['resources'].aclose()
+
+# lets the app push status changes to its event streams
+async def job_started(ctx):
+    await publish_job_event(ctx['redis'], ctx['job_id'])
+
+async def job_ended(ctx):
+    await publish_job_event(ctx['redis'], ctx['job_id'])
+
+
+def limited(name, coroutine):
+    """`coroutine` running at most FUNCTION_LIMITS[name] times at once.
+
+    A job waiting for its turn holds one of the WORKER_MAX_JOBS slots.
+    """
+    if name not in FUNCTION_LIMITS:
+        return coroutine
+
+    @functools.wraps(coroutine)
+    async def job(ctx, *args, **kwargs):
+        async with ctx['limits'][name]:
+            return await coroutine(ctx, *args, **kwargs)
+
+    return job
+
+
+def job_function(name, coroutine):
+    return func(limited(name, coroutine), name=name)
+
 
 FUNCTIONS: list = [
-    create_task,
+    job_function('create_task', create_task)
+    if CREATE_TASK_BATCH_SIZE <= 1 else
+    job_function('create_task', batched(create_tasks, CREATE_TASK_BATCH_SIZE, CREATE_TASK_BATCH_WAIT)),
 ]
 
 class WorkerSettings:
     on_startup = startup
     on_shutdown = shutdown
-    redis_settings = RedisSettings()
+    on_job_start = job_started
+    # after the result is stored, so it can be read right away
+    after_job_end = job_ended
+    redis_settings = REDIS_SETTINGS
     functions: list = FUNCTIONS
+    max_jobs = WORKER_MAX_JOBS
+    queue_read_limit = WORKER_QUEUE_READ_LIMIT
+    poll_delay = WORKER_POLL_DELAY
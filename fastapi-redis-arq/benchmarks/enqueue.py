@@ -0,0 +1,59 @@
+"""Enqueue throughput in jobs/s: enqueue_job per job vs. enqueue_many.
+
+For 1, 100 and 10,000 jobs per call, enqueues about JOBS jobs with a loop
+of `enqueue_job` (what POST /task did), with `enqueue_many`, and with
+`enqueue_many` given an idempotency key per job. Needs a Redis at
+REDIS_URL; the jobs are deleted again after each run. Run from the
+`fastapi-redis-arq` directory:
+
+    python -m benchmarks.enqueue [jobs]
+"""
+import asyncio
+import sys
+import time
+from uuid import uuid4
+from arq.constants import job_key_prefix
+from app.enqueue import enqueue_many
+from app.main import create_queue
+
+JOBS = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+BATCH_SIZES = [1, 100, 10_000]
+
+
+async def loop(queue, size):
+    return [(await queue.enqueue_job('create_task', 1)).job_id for _ in range(size)]
+
+
+async def bulk(queue, size):
+    jobs = await enqueue_many(queue, 'create_task', [(1,)] * size)
+    return [job_id for job_id, created in jobs]
+
+
+async def bulk_keys(queue, size):
+    jobs = await enqueue_many(queue, 'create_task', [(1,)] * size, [uuid4().hex for _ in range(size)])
+    return [job_id for job_id, created in jobs]
+
+
+async def clean(queue, job_ids):
+    await queue.zrem(queue.default_queue_name, *job_ids)
+    for start in range(0, len(job_ids), 1000):
+        await queue.delete(*(job_key_prefix + job_id for job_id in job_ids[start:start + 1000]))
+
+
+async def main():
+    queue = await create_queue()
+    for size in BATCH_SIZES:
+        calls = max(JOBS // size, 1)
+        for name, enqueue in (("enqueue_job", loop), ("enqueue_many", bulk), ("  with keys", bulk_keys)):
+            job_ids = []
+            start = time.perf_counter()
+            for _ in range(calls):
+                job_ids += await enqueue(queue, size)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>6} per call | {name:<12} | {calls * size / elapsed:9.0f} jobs/s", flush=True)
+            await clean(queue, job_ids)
+    await queue.close(close_connection_pool=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""POST /task under concurrent load, one Redis pool per request vs. the shared one.
+
+The per-request mode puts back what the endpoints used to do (a new
+`create_pool` per call, never closed) through a dependency override.
+Reports latency percentiles and the most Redis sockets this process had
+open at once. Needs a Redis at REDIS_URL; run from the `fastapi-redis-arq`
+directory:
+
+    python -m benchmarks.load
+"""
+import asyncio
+import os
+import statistics
+import time
+import httpx
+from arq.connections import create_pool
+from app.main import REDIS_SETTINGS, app, get_queue, lifespan
+
+REQUESTS = 2_000
+CONCURRENCY = 50
+
+
+def open_sockets() -> int:
+    # httpx talks to the app in memory, so these are all Redis connections
+    return sum(
+        os.readlink(f'/proc/self/fd/{fd}').startswith('socket:')
+        for fd in os.listdir('/proc/self/fd')
+        if os.path.exists(f'/proc/self/fd/{fd}')
+    )
+
+
+async def per_request_queue():
+    return await create_pool(REDIS_SETTINGS)
+
+
+async def run(name):
+    latencies = []
+    remaining = iter(range(REQUESTS))
+    baseline = open_sockets()
+    peak = 0
+    async with lifespan(app), httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url='http://bench',
+    ) as client:
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await client.post('/task', json={'count': 1})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        async def sample():
+            nonlocal peak
+            while True:
+                peak = max(peak, open_sockets() - baseline)
+                await asyncio.sleep(0.01)
+
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+        await app.state.queue.delete(app.state.queue.default_queue_name)
+    latencies.sort()
+    print(
+        f"{name:<12} | {REQUESTS / elapsed:7.1f} req/s | "
+        f"p50 {statistics.median(latencies) * 1e3:7.2f} ms | "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:7.2f} ms | "
+        f"at most {peak} sockets open"
+    )
+
+
+async def main():
+    app.dependency_overrides[get_queue] = per_request_queue
+    await run("per request")
+    app.dependency_overrides.clear()
+    await run("shared")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Worker throughput in jobs/s for a range of max_jobs, one job per call
+and batched.
+
+Queues JOBS jobs that each make one JOB_SECONDS call to a backend taking
+BACKEND_CONNECTIONS calls at once, like a database or model server, then
+runs a burst worker until the queue is empty. The batched rows use a
+batch size of max_jobs and make one backend call per batch. Needs a
+Redis at REDIS_URL; the jobs go to their own queue and keep no result.
+Run from the `fastapi-redis-arq` directory:
+
+    python -m benchmarks.worker [jobs]
+"""
+import asyncio
+import sys
+import time
+from arq.worker import Worker
+from app.batch import batched
+from app.enqueue import enqueue_many
+from app.main import create_queue
+from app.worker import job_function, startup, shutdown
+
+JOBS = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+JOB_SECONDS = 0.05
+BACKEND_CONNECTIONS = 4
+MAX_JOBS = [1, 10, 50, 100, 500]
+QUEUE_NAME = 'arq:benchmark'
+
+
+backend = asyncio.Semaphore(BACKEND_CONNECTIONS)
+
+
+async def sleep_job(ctx, seconds):
+    async with backend:
+        await asyncio.sleep(seconds)
+    return seconds
+
+
+async def sleep_jobs(ctx, calls):
+    async with backend:
+        await asyncio.sleep(max(seconds for seconds, in calls))
+    return [seconds for seconds, in calls]
+
+
+async def run(max_jobs, function):
+    queue = await create_queue()
+    jobs = min(JOBS, max_jobs * 100)
+    await enqueue_many(queue, 'sleep_job', [(JOB_SECONDS,)] * jobs, queue_name=QUEUE_NAME)
+    worker = Worker(
+        functions=[job_function('sleep_job', function)],
+        redis_pool=queue,
+        queue_name=QUEUE_NAME,
+        burst=True,
+        max_jobs=max_jobs,
+        poll_delay=0.01,
+        keep_result=0,
+        on_startup=startup,
+        on_shutdown=shutdown,
+    )
+    start = time.perf_counter()
+    await worker.async_run()
+    elapsed = time.perf_counter() - start
+    await worker.close()
+    return worker.jobs_complete / elapsed
+
+
+async def main():
+    for max_jobs in MAX_JOBS:
+        single = await run(max_jobs, sleep_job)
+        batch = await run(max_jobs, batched(sleep_jobs, max_jobs, 0.01))
+        print(f"max_jobs {max_jobs:>4} | {single:8.0f} jobs/s | batched {batch:8.0f} jobs/s", flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
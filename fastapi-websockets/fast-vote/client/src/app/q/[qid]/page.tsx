@@ -24,13 +24,51 @@ async function submitVote(optId: string) {
   return true;
 }
 
-type WSMessage = {
-  type: "voted";
-  payload: Poll["options"];
-};
+type WSMessage =
+  | {
+      // vote count of every option that changed since the last message
+      type: "tally";
+      payload: Record<string, number>;
+    }
+  | {
+      // heartbeat, the server drops sockets that stop answering
+      type: "ping";
+    }
+  | {
+      // sent first on binary sockets, tally frames use these positions
+      type: "options";
+      payload: string[];
+    };
+
+// binary frames: a type byte, then (uint8 option index, uint32 votes) pairs
+const BINARY_TALLY = 1;
+const BINARY_PING = 2;
+
+function decodeFrame(data: string | ArrayBuffer, optionIds: string[]) {
+  if (typeof data === "string") {
+    return JSON.parse(data) as WSMessage;
+  }
+  const view = new DataView(data);
+  const type = view.getUint8(0);
+  if (type === BINARY_PING) {
+    return { type: "ping" } as WSMessage;
+  }
+  if (type !== BINARY_TALLY) {
+    return null;
+  }
+  const payload: Record<string, number> = {};
+  for (let offset = 1; offset + 5 <= view.byteLength; offset += 5) {
+    payload[optionIds[view.getUint8(offset)]] = view.getUint32(
+      offset + 1,
+      true
+    );
+  }
+  return { type: "tally", payload } as WSMessage;
+}
 
 export default function Page({ params }: { params: { qid: string } }) {
   const wsRef = useRef<WebSocket | null>(null);
+  const optionIdsRef = useRef<string[]>([]);
   const [poll, setPoll] = useState<PollRes | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string>("");
@@ -57,13 +95,24 @@ export default function Page({ params }: { params: { qid: string } }) {
   }, [params]);
 
   const handleMessage = useCallback((e: MessageEvent) => {
-    const res = JSON.parse(e.data) as WSMessage;
-    if (res.type === "voted") {
+    const res = decodeFrame(e.data, optionIdsRef.current);
+    if (!res) return;
+    if (res.type === "options") {
+      optionIdsRef.current = res.payload;
+    }
+    if (res.type === "ping") {
+      wsRef.current?.send(JSON.stringify({ type: "pong" }));
+    }
+    if (res.type === "tally") {
       setPoll((prev) => {
         if (!prev) return null;
         return {
           ...prev,
-          options: res.payload,
+          options: prev.options.map((option) =>
+            option.id in res.payload
+              ? { ...option, votes: res.payload[option.id] }
+              : option
+          ),
         };
       });
     }
@@ -73,7 +122,10 @@ export default function Page({ params }: { params: { qid: string } }) {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
       wsRef.current?.close();
     }
-    const ws = new WebSocket(`ws://localhost:8000/ws/poll/${params.qid}`);
+    const ws = new WebSocket(
+      `ws://localhost:8000/ws/poll/${params.qid}?encoding=binary`
+    );
+    ws.binaryType = "arraybuffer";
     wsRef.current = ws;
     ws.onopen = () => {
       ws.addEventListener("message", handleMessage);
@@ -0,0 +1,90 @@
+import asyncio
+import os
+from typing import Callable, List, Optional
+
+# encoded broadcasts are handed to this callback on every subscribed worker
+TOnMessage = Callable[[bytes], None]
+
+REDIS_URL = os.getenv("FAST_VOTE_REDIS_URL")
+REDIS_CHANNEL = "fast-vote:broadcast"
+
+
+class Backplane:
+    """Carries already encoded broadcasts between WSManager instances.
+
+    Every worker subscribes with `start` and gets every message published
+    by any worker (itself included), so a broadcast reaches the sockets of
+    all workers. Messages are opaque bytes, the backplane never looks into
+    them.
+    """
+
+    async def start(self, on_message: TOnMessage):
+        raise NotImplementedError
+
+    async def publish(self, data: bytes):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class LocalBackplane(Backplane):
+    """In-process backplane.
+
+    Managers sharing one instance behave like workers sharing a Redis
+    channel, which is what the single worker setup and the tests need.
+    """
+
+    def __init__(self):
+        self.subscribers: List[TOnMessage] = []
+
+    async def start(self, on_message: TOnMessage):
+        self.subscribers.append(on_message)
+
+    async def publish(self, data: bytes):
+        for on_message in list(self.subscribers):
+            on_message(data)
+
+    async def stop(self):
+        self.subscribers.clear()
+
+
+class RedisBackplane(Backplane):
+    """Redis pub/sub backplane for multiple workers and nodes."""
+
+    def __init__(self, url: str, channel: str = REDIS_CHANNEL):
+        # only needed when running with more than one worker
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url)
+        self.channel = channel
+        self.pubsub = None
+        self.listener: Optional[asyncio.Task] = None
+
+    async def start(self, on_message: TOnMessage):
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(self.channel)
+        self.listener = asyncio.create_task(self._listen(on_message))
+
+    async def publish(self, data: bytes):
+        await self.redis.publish(self.channel, data)
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+        if self.pubsub is not None:
+            await self.pubsub.unsubscribe(self.channel)
+            await self.pubsub.close()
+            self.pubsub = None
+        await self.redis.close()
+
+    async def _listen(self, on_message: TOnMessage):
+        async for message in self.pubsub.listen():
+            on_message(message["data"])
+
+
+def make_backplane() -> Backplane:
+    if REDIS_URL:
+        return RedisBackplane(REDIS_URL)
+    return LocalBackplane()
@@ -0,0 +1,90 @@
+"""Vote-to-last-client latency of a poll broadcast.
+
+Run from the `server` directory:
+
+    python -m benchmarks.broadcast
+"""
+import asyncio
+import time
+from ws import WSManager, encode_message
+
+PAYLOAD = {
+    "type": "voted",
+    "payload": [
+        {"id": f"option-{i}", "option_text": f"Option {i}", "votes": i}
+        for i in range(5)
+    ],
+}
+
+
+class FakeWebSocket:
+    """Stands in for a client, optionally with a slow network."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received_at = None
+
+    async def send_json(self, message):
+        await self.send_text(encode_message(message))
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received_at = time.perf_counter()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def serial_broadcast(sockets):
+    # what WSManager.send_message used to do
+    for ws in sockets:
+        await ws.send_json(PAYLOAD)
+
+
+async def run(clients: int, slow_clients: int, slow_delay: float):
+    # slow clients first, so the serial loop has to wait for them
+    sockets = [FakeWebSocket(slow_delay) for _ in range(slow_clients)]
+    fast = [FakeWebSocket() for _ in range(clients - slow_clients)]
+    sockets += fast
+
+    start = time.perf_counter()
+    await serial_broadcast(sockets)
+    serial_total = time.perf_counter() - start
+    serial_fast = max(ws.received_at for ws in fast) - start
+
+    manager = WSManager()
+    await manager.start()
+    for ws in sockets:
+        await manager.connect("poll", ws)
+    for ws in sockets:
+        ws.received_at = None
+
+    start = time.perf_counter()
+    await manager.send_message("poll", PAYLOAD)
+    returned = time.perf_counter() - start
+    while any(ws.received_at is None for ws in fast):
+        await asyncio.sleep(0)
+    queued_fast = max(ws.received_at for ws in fast) - start
+
+    for ws in sockets:
+        await manager.disconnect("poll", ws)
+    await manager.stop()
+
+    print(
+        f"{clients:>6} clients ({slow_clients} slow) | "
+        f"serial: last fast client {serial_fast * 1000:8.2f} ms, "
+        f"caller blocked {serial_total * 1000:8.2f} ms | "
+        f"queued: last fast client {queued_fast * 1000:8.2f} ms, "
+        f"caller blocked {returned * 1000:8.2f} ms"
+    )
+
+
+async def main():
+    for clients in (1_000, 10_000):
+        await run(clients, slow_clients=0, slow_delay=0)
+        await run(clients, slow_clients=1, slow_delay=0.5)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Socket writes caused by a burst of votes, with and without coalescing.
+
+Run from the `server` directory:
+
+    python -m benchmarks.coalesce
+"""
+import asyncio
+import random
+from ws import WSManager
+from benchmarks.broadcast import FakeWebSocket
+
+OPTIONS = [f"option-{i}" for i in range(5)]
+
+
+class CountingWebSocket(FakeWebSocket):
+    writes = 0
+
+    async def send_text(self, data):
+        CountingWebSocket.writes += 1
+
+
+async def run(tick: float, votes_per_second: int, subscribers: int):
+    manager = WSManager(queue_size=1024, tally_tick=tick)
+    counts = {"poll": {}}
+    manager.counts_source = counts.get
+    sockets = [CountingWebSocket() for _ in range(subscribers)]
+    await manager.start()
+    for ws in sockets:
+        await manager.connect("poll", ws)
+    CountingWebSocket.writes = 0
+
+    # one second of votes, spread over 1 ms slices
+    per_slice = votes_per_second // 1000
+    for _ in range(1000):
+        for _ in range(per_slice):
+            option_id = random.choice(OPTIONS)
+            counts["poll"][option_id] = counts["poll"].get(option_id, 0) + 1
+            manager.publish_vote("poll", option_id)
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(tick + 0.05)
+
+    metrics = manager.tally_metrics.snapshot()
+    print(
+        f"tick {tick * 1000:4.0f} ms | {votes_per_second} votes/s, "
+        f"{subscribers} subscribers | socket writes {CountingWebSocket.writes:>9} | "
+        f"avg batch {metrics['avg_batch']:7.1f} | "
+        f"max tick lag {metrics['max_tick_lag_ms']:6.2f} ms"
+    )
+    for ws in sockets:
+        await manager.disconnect("poll", ws)
+    await manager.stop()
+
+
+async def main():
+    for tick in (0, 0.05, 0.1):
+        await run(tick, votes_per_second=5_000, subscribers=100)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
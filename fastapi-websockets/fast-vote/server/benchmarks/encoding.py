@@ -0,0 +1,82 @@
+"""Egress bytes and CPU of JSON vs. binary tally frames, with and without
+permessage-deflate, for 10k subscribers of one poll.
+
+Deflate is simulated with one zlib stream per socket, which is what
+permessage-deflate with context takeover does. Run from the `server`
+directory:
+
+    python -m benchmarks.encoding
+"""
+import asyncio
+import random
+import time
+import zlib
+from uuid import uuid4 as uuid
+from ws import ENCODING_BINARY, ENCODING_JSON, WSManager, encode_message
+
+SUBSCRIBERS = 10_000
+TICKS = 100
+# one tally message per 50 ms tick
+TICKS_PER_SECOND = 20
+OPTION_IDS = [str(uuid()) for _ in range(5)]
+
+
+class MeteredWebSocket:
+    def __init__(self, deflate: bool):
+        self.compressor = zlib.compressobj(wbits=-15) if deflate else None
+        self.bytes = 0
+
+    async def send_text(self, data):
+        await self.send_bytes(data.encode())
+
+    async def send_bytes(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(data) + \
+                self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes += len(data)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run(encoding: str, deflate: bool):
+    manager = WSManager(queue_size=TICKS + 1)
+    sockets = [MeteredWebSocket(deflate) for _ in range(SUBSCRIBERS)]
+    for ws in sockets:
+        await manager.connect("poll", ws, encoding, OPTION_IDS)
+    messages = [
+        encode_message({"type": "tally", "payload": {
+            option_id: random.randint(1, 300) for option_id in OPTION_IDS
+        }})
+        for _ in range(TICKS)
+    ]
+
+    cpu = time.process_time()
+    for data in messages:
+        manager.broadcast_encoded("poll", data)
+        # let the writers drain before the next tick
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+    cpu = time.process_time() - cpu
+
+    total = sum(ws.bytes for ws in sockets)
+    seconds = TICKS / TICKS_PER_SECOND
+    name = encoding + (" + deflate" if deflate else "")
+    print(
+        f"{name:<17} | {total / seconds / 1e6:8.2f} MB/s egress | "
+        f"{total / TICKS / SUBSCRIBERS:6.1f} B/frame | "
+        f"{cpu / seconds * 100:6.1f}% of a core"
+    )
+    for ws in sockets:
+        await manager.disconnect("poll", ws)
+
+
+async def main():
+    print(f"{SUBSCRIBERS} subscribers, {TICKS_PER_SECOND} tallies/s")
+    for encoding in (ENCODING_JSON, ENCODING_BINARY):
+        for deflate in (False, True):
+            await run(encoding, deflate)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
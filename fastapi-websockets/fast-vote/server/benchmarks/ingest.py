@@ -0,0 +1,93 @@
+"""Vote ingestion throughput, committing each vote vs. write-behind batches.
+
+Uses a throwaway SQLite database. Run from the `server` directory:
+
+    python -m benchmarks.ingest
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "ingest.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_FILE}"
+
+from sqlmodel import select  # noqa: E402
+from database import async_session, create_db_and_tables, engine  # noqa: E402
+from dedup import VoterIndex  # noqa: E402
+from ingest import DURABILITY_BATCHED, VoteIngestor  # noqa: E402
+from models import Option, Poll, Vote  # noqa: E402
+from tally import VoteTally  # noqa: E402
+
+VOTES = 5_000
+CONCURRENCY = 50
+
+
+async def create_poll():
+    async with async_session() as session:
+        options = [Option(option_text=f"Option {i}") for i in range(5)]
+        poll = Poll(poll_text="Ingest", user_id="bench", options=options)
+        session.add(poll)
+        await session.commit()
+        return poll.id, [option.id for option in options]
+
+
+async def sync_vote(poll_id: str, option_id: str, user_id: str):
+    # one duplicate SELECT, INSERT and commit per vote
+    async with async_session() as session:
+        statement = select(Vote.id)\
+            .where(Vote.user_id == user_id, Vote.option_id == option_id)
+        if (await session.exec(statement)).first():
+            return
+        session.add(Vote(option_id=option_id, user_id=user_id, poll_id=poll_id))
+        await session.commit()
+
+
+async def run_sync(poll_id, option_ids):
+    async def worker(n):
+        for i in range(n, VOTES, CONCURRENCY):
+            await sync_vote(poll_id, option_ids[i % len(option_ids)], f"sync-{i}")
+    await asyncio.gather(*(worker(n) for n in range(CONCURRENCY)))
+
+
+async def run_batched(poll_id, option_ids):
+    voter_index = VoterIndex()
+    ingestor = VoteIngestor(
+        async_session, VoteTally(), voter_index,
+        durability=DURABILITY_BATCHED,
+    )
+    await ingestor.start()
+
+    async def worker(n):
+        async with async_session() as session:
+            for i in range(n, VOTES, CONCURRENCY):
+                option_id = option_ids[i % len(option_ids)]
+                user_id = f"batched-{i}"
+                await ingestor.poll_of(session, option_id)
+                if await voter_index.claim(session, poll_id, user_id):
+                    await ingestor.enqueue(poll_id, option_id, user_id)
+    await asyncio.gather(*(worker(n) for n in range(CONCURRENCY)))
+    # stop() returns once everything queued is committed
+    await ingestor.stop()
+    assert ingestor.flushed_votes == VOTES
+
+
+async def main():
+    await create_db_and_tables()
+    for name in ("sync", "batched"):
+        poll_id, option_ids = await create_poll()
+        start = time.perf_counter()
+        if name == "sync":
+            await run_sync(poll_id, option_ids)
+        else:
+            await run_batched(poll_id, option_ids)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:<8} {VOTES} votes, {CONCURRENCY} concurrent | "
+            f"{VOTES / elapsed:10.1f} votes/s"
+        )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
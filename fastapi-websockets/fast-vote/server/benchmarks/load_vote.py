@@ -0,0 +1,90 @@
+"""Latency of /vote/ while many websocket clients watch the same poll.
+
+Needs a running server and `pip install httpx`, e.g.
+
+    uvicorn main:app
+    python -m benchmarks.load_vote --sockets 1000 --votes 5000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from uuid import uuid4 as uuid
+import httpx
+import websockets
+
+
+async def watch(ws_url: str, ready: asyncio.Event, stop: asyncio.Event):
+    async with websockets.connect(ws_url) as ws:
+        ready.set()
+        while not stop.is_set():
+            try:
+                data = await asyncio.wait_for(ws.recv(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            if json.loads(data).get("type") == "ping":
+                await ws.send(json.dumps({"type": "pong"}))
+
+
+async def cast_votes(client, option_ids, votes, latencies):
+    for i in range(votes):
+        # a fresh session per vote, every voter is a different user
+        cookies = {"fast-vote-session": str(uuid())}
+        start = time.perf_counter()
+        response = await client.post(
+            "/vote/",
+            params={"option_id": option_ids[i % len(option_ids)]},
+            cookies=cookies,
+        )
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+
+async def main(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        response = await client.post("/create-poll/", json={
+            "poll": "Load test",
+            "options": ["A", "B", "C", "D", "E"],
+        })
+        poll_id = response.json()
+        poll = (await client.get(f"/get-poll/{poll_id}")).json()
+        option_ids = [option["id"] for option in poll["options"]]
+
+        ws_url = args.url.replace("http", "ws", 1) + f"/ws/poll/{poll_id}"
+        stop = asyncio.Event()
+        watchers = []
+        for _ in range(args.sockets):
+            ready = asyncio.Event()
+            watchers.append(asyncio.create_task(watch(ws_url, ready, stop)))
+            await ready.wait()
+
+        latencies = []
+        per_worker = args.votes // args.concurrency
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            cast_votes(client, option_ids, per_worker, latencies)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await asyncio.gather(*watchers, return_exceptions=True)
+        await client.delete(f"/poll/{poll_id}")
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{len(latencies)} votes, {args.concurrency} concurrent, "
+        f"{args.sockets} sockets | {len(latencies) / elapsed:8.1f} votes/s | "
+        f"p50 {quantiles[49] * 1000:7.2f} ms | "
+        f"p99 {quantiles[98] * 1000:7.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--votes", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
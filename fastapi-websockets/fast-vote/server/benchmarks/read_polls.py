@@ -0,0 +1,75 @@
+"""Round trips and latency of the /get-user-polls/ read path.
+
+Seeds a throwaway SQLite database and fails if listing a user's polls
+takes more than two queries. Run from the `server` directory:
+
+    python -m benchmarks.read_polls
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "read_polls.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_FILE}"
+
+from sqlalchemy import event  # noqa: E402
+from database import async_session, create_db_and_tables, engine  # noqa: E402
+from models import Option, Poll, Vote  # noqa: E402
+from queries import get_user_polls  # noqa: E402
+from tally import VoteTally  # noqa: E402
+
+USER = "bench-user"
+POLLS = 50
+OPTIONS = 5
+VOTES_PER_OPTION = 20
+MAX_QUERIES = 2
+
+
+async def seed():
+    await create_db_and_tables()
+    async with async_session() as session:
+        for i in range(POLLS):
+            options = [
+                Option(option_text=f"Option {j}") for j in range(OPTIONS)
+            ]
+            poll = Poll(poll_text=f"Poll {i}", user_id=USER, options=options)
+            session.add(poll)
+            session.add_all(
+                Vote(option_id=option.id, user_id=f"voter-{j}-{k}", poll_id=poll.id)
+                for j, option in enumerate(options)
+                for k in range(VOTES_PER_OPTION)
+            )
+        await session.commit()
+
+
+async def main():
+    await seed()
+    queries = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    tally = VoteTally()
+    for label in ("cold tally", "warm tally"):
+        queries.clear()
+        async with async_session() as session:
+            start = time.perf_counter()
+            polls = await get_user_polls(session, USER, tally)
+            elapsed = time.perf_counter() - start
+        assert len(polls) == POLLS
+        assert all(
+            option.votes == VOTES_PER_OPTION
+            for poll in polls for option in poll.options
+        )
+        print(
+            f"{label}: {POLLS} polls x {OPTIONS} options in "
+            f"{len(queries)} queries, {elapsed * 1000:.2f} ms"
+        )
+        assert len(queries) <= MAX_QUERIES, queries
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""CPU spent on idle sockets by the websocket receive loop.
+
+Compares the old loop (sleep 0.5 s, then wait for a message) with the
+event driven loop plus the manager's heartbeat. Clients never vote, they
+only answer pings. Run from the `server` directory:
+
+    python -m benchmarks.soak
+"""
+import asyncio
+import time
+from ws import WSManager
+
+SOCKETS = 10_000
+DURATION = 20
+
+
+class IdleWebSocket:
+    """A client that says nothing except answering the server's pings."""
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+
+    async def send_text(self, data):
+        if '"ping"' in data:
+            self.incoming.put_nowait('{"type":"pong"}')
+
+    async def receive_text(self):
+        return await self.incoming.get()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def old_loop(ws: IdleWebSocket):
+    while True:
+        await asyncio.sleep(0.5)
+        await ws.receive_text()
+
+
+async def new_loop(manager: WSManager, ws: IdleWebSocket):
+    await manager.connect("poll", ws)
+    while True:
+        await ws.receive_text()
+        manager.touch(ws)
+
+
+async def soak(name: str, make_tasks, heartbeat: float):
+    tasks = make_tasks()
+    # let every connection settle before measuring
+    await asyncio.sleep(1)
+    cpu = time.process_time()
+    await asyncio.sleep(DURATION)
+    cpu = time.process_time() - cpu
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    print(
+        f"{name:<28} heartbeat {heartbeat:>4} s | "
+        f"{cpu * 1000 / DURATION:8.2f} ms CPU per second "
+        f"for {SOCKETS} idle sockets"
+    )
+
+
+async def main():
+    sockets = [IdleWebSocket() for _ in range(SOCKETS)]
+    await soak(
+        "sleep 0.5 s + receive_json",
+        lambda: [asyncio.create_task(old_loop(ws)) for ws in sockets],
+        heartbeat=0,
+    )
+    for heartbeat in (10, 5, 1):
+        manager = WSManager(heartbeat_interval=heartbeat)
+        await manager.start()
+        sockets = [IdleWebSocket() for _ in range(SOCKETS)]
+        await soak(
+            "event driven + heartbeat",
+            lambda: [
+                asyncio.create_task(new_loop(manager, ws)) for ws in sockets
+            ],
+            heartbeat=heartbeat,
+        )
+        for ws in sockets:
+            await manager.disconnect("poll", ws)
+        await manager.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+import math
+import os
+from hashlib import blake2b
+from typing import Dict, Iterable, Set, Union
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Vote
+
+# polls keep an exact set of voters up to this many, then switch to a
+# Bloom filter and ask the database whenever the filter says "maybe"
+EXACT_LIMIT = int(os.getenv("FAST_VOTE_DEDUP_EXACT_LIMIT", "10000"))
+BLOOM_CAPACITY = int(os.getenv("FAST_VOTE_DEDUP_BLOOM_CAPACITY", "1000000"))
+BLOOM_ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (1.2 MB per million at 1%)."""
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.size = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+TVoters = Union[Set[str], BloomFilter]
+
+
+class VoterIndex:
+    """Who voted on which poll, for one-vote-per-poll checks in memory.
+
+    A vote is first claimed (reserved while it is being written), then
+    confirmed once committed or released if the write failed. The index
+    only knows the votes of this process and what was in the database
+    when a poll was loaded, so with several workers it is only the fast
+    path: the unique (poll_id, user_id) constraint on Vote rejects the
+    votes it lets through twice.
+    """
+
+    def __init__(
+        self,
+        exact_limit: int = EXACT_LIMIT,
+        bloom_capacity: int = BLOOM_CAPACITY,
+    ):
+        self.exact_limit = exact_limit
+        self.bloom_capacity = bloom_capacity
+        self.voters: Dict[str, TVoters] = {}
+        self.pending: Dict[str, Set[str]] = {}
+        self.db_checks = 0
+
+    async def warm(self, session: AsyncSession):
+        statement = select(Vote.poll_id, Vote.user_id)
+        result = await session.stream(statement)
+        async for poll_id, user_id in result:
+            self._add(poll_id, user_id)
+
+    async def claim(
+        self, session: AsyncSession, poll_id: str, user_id: str
+    ) -> bool:
+        """Reserve the user's vote on the poll, False if they already voted."""
+        if poll_id not in self.voters:
+            await self._load(session, poll_id)
+        voters = self.voters.setdefault(poll_id, set())
+        pending = self.pending.setdefault(poll_id, set())
+        if user_id in pending:
+            return False
+        if isinstance(voters, BloomFilter):
+            if user_id not in voters:
+                pending.add(user_id)
+                return True
+            # maybe a false positive; hold the claim while we check
+            pending.add(user_id)
+            self.db_checks += 1
+            if await self._voted_in_db(session, poll_id, user_id):
+                pending.discard(user_id)
+                return False
+            return True
+        if user_id in voters:
+            return False
+        pending.add(user_id)
+        return True
+
+    def confirm(self, poll_id: str, user_ids: Iterable[str]):
+        pending = self.pending.get(poll_id, set())
+        for user_id in user_ids:
+            pending.discard(user_id)
+            self._add(poll_id, user_id)
+
+    def release(self, poll_id: str, user_id: str):
+        self.pending.get(poll_id, set()).discard(user_id)
+
+    def forget(self, poll_id: str):
+        self.voters.pop(poll_id, None)
+        self.pending.pop(poll_id, None)
+
+    def _add(self, poll_id: str, user_id: str):
+        voters = self.voters.setdefault(poll_id, set())
+        voters.add(user_id)
+        if isinstance(voters, set) and len(voters) > self.exact_limit:
+            bloom = BloomFilter(self.bloom_capacity)
+            for voter in voters:
+                bloom.add(voter)
+            self.voters[poll_id] = bloom
+
+    async def _load(self, session: AsyncSession, poll_id: str):
+        statement = select(Vote.user_id).where(Vote.poll_id == poll_id)
+        for user_id in await session.exec(statement):
+            self._add(poll_id, user_id)
+
+    async def _voted_in_db(
+        self, session: AsyncSession, poll_id: str, user_id: str
+    ) -> bool:
+        statement = select(Vote.id)\
+            .where(Vote.poll_id == poll_id, Vote.user_id == user_id)\
+            .limit(1)
+        return (await session.exec(statement)).first() is not None
+
+
+voter_index = VoterIndex()
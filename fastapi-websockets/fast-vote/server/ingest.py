@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, List, NamedTuple, Optional
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from dedup import VoterIndex
+from models import Option, Vote, get_defult_uuid
+from tally import VoteTally
+
+logger = logging.getLogger(__name__)
+
+# "sync": every vote is committed before /vote/ answers (one fsync per vote)
+# "batched": votes are acknowledged once queued and written by a background
+# task with multi-row inserts, a crash loses what hasn't been flushed yet
+DURABILITY_SYNC = "sync"
+DURABILITY_BATCHED = "batched"
+VOTE_DURABILITY = os.getenv("FAST_VOTE_DURABILITY", DURABILITY_SYNC)
+# a batch is written after FLUSH_INTERVAL seconds or FLUSH_SIZE votes
+FLUSH_INTERVAL = float(os.getenv("FAST_VOTE_FLUSH_MS", "50")) / 1000
+FLUSH_SIZE = int(os.getenv("FAST_VOTE_FLUSH_SIZE", "500"))
+# /vote/ waits for room once this many votes are waiting to be written
+MAX_PENDING = FLUSH_SIZE * 20
+
+
+class QueuedVote(NamedTuple):
+    poll_id: str
+    option_id: str
+    user_id: str
+
+
+# called with every batch once it is committed
+TFlushListener = Callable[[List[QueuedVote]], None]
+
+
+class VoteIngestor:
+    """Write-behind queue for votes.
+
+    Votes must be claimed in the voter index before they are queued; the
+    claim is confirmed once the batch is committed.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        tally: VoteTally,
+        voter_index: VoterIndex,
+        durability: str = VOTE_DURABILITY,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_size: int = FLUSH_SIZE,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.session_factory = session_factory
+        self.tally = tally
+        self.voter_index = voter_index
+        self.batched = durability == DURABILITY_BATCHED
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.batch_ready = asyncio.Event()
+        self.option_polls: Dict[str, str] = {}
+        self.flush_listeners: List[TFlushListener] = []
+        self.runner: Optional[asyncio.Task] = None
+        self.flushed_batches = 0
+        self.flushed_votes = 0
+        self.failed_votes = 0
+        self.duplicate_votes = 0
+
+    async def start(self):
+        if self.batched:
+            self.runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.runner is None:
+            return
+        # the runner writes whatever is queued ahead of the None and exits
+        await self.queue.put(None)
+        self.batch_ready.set()
+        await self.runner
+        self.runner = None
+
+    async def poll_of(
+        self, session: AsyncSession, option_id: str
+    ) -> Optional[str]:
+        poll_id = self.option_polls.get(option_id)
+        if poll_id is None:
+            statement = select(Option.poll_id).where(Option.id == option_id)
+            poll_id = (await session.exec(statement)).first()
+            if poll_id is not None:
+                self.option_polls[option_id] = poll_id
+        return poll_id
+
+    async def enqueue(self, poll_id: str, option_id: str, user_id: str):
+        await self.queue.put(QueuedVote(poll_id, option_id, user_id))
+        if self.queue.qsize() >= self.flush_size:
+            self.batch_ready.set()
+
+    def forget(self, poll_id: str):
+        # queued votes of a deleted poll are skipped at flush time
+        for option_id in [
+            option_id for option_id, option_poll in self.option_polls.items()
+            if option_poll == poll_id
+        ]:
+            del self.option_polls[option_id]
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is not None:
+                try:
+                    await asyncio.wait_for(
+                        self.batch_ready.wait(), timeout=self.flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            batch = [first] + self._take(self.flush_size - 1)
+            if self.queue.qsize() < self.flush_size:
+                self.batch_ready.clear()
+            stopping = None in batch
+            await self._flush([vote for vote in batch if vote is not None])
+
+    def _take(self, limit: int) -> List[QueuedVote]:
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _flush(self, batch: List[QueuedVote]):
+        batch = [vote for vote in batch if vote.option_id in self.option_polls]
+        if not batch:
+            return
+        try:
+            try:
+                await self._insert(batch)
+            except IntegrityError:
+                # someone in the batch already voted through another
+                # worker; write the votes one by one to skip them
+                batch = await self._insert_each(batch)
+        except Exception:
+            logger.exception("dropping a batch of %d votes", len(batch))
+            self.failed_votes += len(batch)
+            # let the voters try again
+            for vote in batch:
+                self.voter_index.release(vote.poll_id, vote.user_id)
+            return
+        for vote in batch:
+            self.voter_index.confirm(vote.poll_id, [vote.user_id])
+        self.flushed_batches += 1
+        self.flushed_votes += len(batch)
+        for listener in self.flush_listeners:
+            listener(batch)
+
+    async def _insert(self, batch: List[QueuedVote]):
+        per_option: Dict[str, int] = {}
+        for vote in batch:
+            per_option[vote.option_id] = per_option.get(vote.option_id, 0) + 1
+        async with self.session_factory() as session:
+            await session.execute(insert(Vote).values([
+                {
+                    "id": get_defult_uuid(),
+                    "option_id": vote.option_id,
+                    "user_id": vote.user_id,
+                    "poll_id": vote.poll_id,
+                }
+                for vote in batch
+            ]))
+            for option_id, count in per_option.items():
+                await self.tally.stage_vote(session, option_id, count)
+            await session.commit()
+
+    async def _insert_each(self, batch: List[QueuedVote]) -> List[QueuedVote]:
+        written = []
+        for vote in batch:
+            try:
+                await self._insert([vote])
+            except IntegrityError:
+                self.duplicate_votes += 1
+                # they did vote, the index just didn't know
+                self.voter_index.confirm(vote.poll_id, [vote.user_id])
+                continue
+            written.append(vote)
+        return written
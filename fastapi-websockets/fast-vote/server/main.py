@@ -1,28 +1,74 @@
+from typing import List
 from uuid import uuid4 as uuid
-import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import (
     FastAPI, WebSocket, WebSocketDisconnect,
     status, Depends, Request, Response
 )
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from auth import get_session_cookie_value
+from database import async_session, create_db_and_tables, engine, get_session
 from models import (
     Poll,
-    create_db_and_tables,
     PollCreateBody,
-    engine,
+    PollRead,
     Option,
     Vote,
 )
-from sqlmodel import Session, select
-from ws import ws_manager
+from dedup import voter_index
+from ingest import QueuedVote, VoteIngestor
+from queries import get_user_polls
+from tally import vote_tally
+from ws import ENCODING_BINARY, ENCODING_JSON, ws_manager
 
 app = FastAPI()
+vote_ingestor = VoteIngestor(async_session, vote_tally, voter_index)
+
+
+def publish_flushed_votes(votes: List[QueuedVote]):
+    for vote in votes:
+        vote_tally.increment(vote.poll_id, vote.option_id)
+        ws_manager.publish_vote(vote.poll_id, vote.option_id)
 
 
 @app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    await create_db_and_tables()
+    # votes handled by other workers reach us through the backplane; listen
+    # before warming, so the tally sees which polls they raced with
+    ws_manager.tally_listeners.append(vote_tally.apply)
+    # clients get absolute counts, so a missed or repeated tally heals
+    ws_manager.counts_source = vote_tally.cached
+    await ws_manager.start()
+    async with async_session() as session:
+        await vote_tally.warm(session)
+        await voter_index.warm(session)
+    vote_tally.correction_listeners.append(ws_manager.broadcast_counts)
+    await vote_tally.start(async_session)
+    vote_ingestor.flush_listeners.append(publish_flushed_votes)
+    await vote_ingestor.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await vote_ingestor.stop()
+    await vote_tally.stop()
+    await ws_manager.stop()
+    await engine.dispose()
+
+
+def serialize_options(options, counts):
+    return [
+        {
+            **option.dict(exclude={"votes", "poll_id", "vote_count"}),
+            "votes": counts.get(option.id, 0),
+        }
+        for option in options
+    ]
 
 
 app.add_middleware(
@@ -48,24 +94,63 @@ async def add_session_id(request: Request, call_next):
 
 
 @app.websocket("/ws/poll/{poll_id}")
-async def websocket_endpoint(websocket: WebSocket, poll_id: str):
-    """This is the websocket handler"""
-    with Session(engine) as session:
-        statement = select(Poll).where(Poll.id == poll_id)
-        poll = session.exec(statement).first()
-        if poll is None:
-            await websocket.close()
-            return
+async def websocket_endpoint(
+    websocket: WebSocket,
+    poll_id: str,
+    encoding: str = ENCODING_JSON,
+):
+    """This is the websocket handler
+
+    With `?encoding=binary` the client first gets the poll's option ids as
+    `{"type": "options", "payload": [...]}` and then binary tally frames
+    that refer to options by their position in that list.
+    """
+    # not a dependency: that would hold a connection for the socket's lifetime
+    async with async_session() as session:
+        statement = select(Option.id)\
+            .where(Option.poll_id == poll_id)\
+            .order_by(Option.id)
+        option_ids = (await session.exec(statement)).all()
+        # tallies for the socket are built from the cached counts
+        if option_ids:
+            await vote_tally.get(session, poll_id)
+    if not option_ids or encoding not in (ENCODING_JSON, ENCODING_BINARY):
+        await websocket.close()
+        return
     await websocket.accept()
-    await ws_manager.connect(poll_id, websocket)
+    if encoding == ENCODING_BINARY:
+        await websocket.send_json({"type": "options", "payload": option_ids})
+    await ws_manager.connect(poll_id, websocket, encoding, option_ids)
     try:
+        # clients only send heartbeat answers, any message counts as alive
         while True:
-            await asyncio.sleep(0.5)
-            await websocket.receive_json()
-    except WebSocketDisconnect:
+            await websocket.receive_text()
+            ws_manager.touch(websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the manager closed the socket while we were waiting
+        pass
+    finally:
         await ws_manager.disconnect(poll_id, websocket)
 
 
+@app.get("/ws-metrics", status_code=status.HTTP_200_OK)
+async def ws_metrics():
+    return {
+        "tally": ws_manager.tally_metrics.snapshot(),
+        "dropped_messages": ws_manager.dropped_messages,
+        "kicked_clients": ws_manager.kicked_clients,
+        "idle_clients": ws_manager.idle_clients,
+        "dedup_db_checks": voter_index.db_checks,
+        "ingest": {
+            "queued_votes": vote_ingestor.queue.qsize(),
+            "flushed_batches": vote_ingestor.flushed_batches,
+            "flushed_votes": vote_ingestor.flushed_votes,
+            "failed_votes": vote_ingestor.failed_votes,
+            "duplicate_votes": vote_ingestor.duplicate_votes,
+        },
+    }
+
+
 @app.get("/assign-session", status_code=status.HTTP_200_OK)
 async def assign_session(
     _: str = Depends(get_session_cookie_value)
@@ -77,126 +162,108 @@ async def assign_session(
 async def create_poll(
     data: PollCreateBody,
     sid: str = Depends(get_session_cookie_value),
+    session: AsyncSession = Depends(get_session),
 ):
-    with Session(engine) as session:
-        options = [Option(option_text=text) for text in data.options]
-        poll = Poll(
-            poll_text=data.poll, user_id=sid, options=options
-        )
-        session.add(poll)
-        session.commit()
-        session.refresh(poll)
-        session.close()
-        return poll.id
-
-
-@app.get("/get-user-polls/", status_code=status.HTTP_200_OK)
+    options = [Option(option_text=text) for text in data.options]
+    poll = Poll(
+        poll_text=data.poll, user_id=sid, options=options
+    )
+    session.add(poll)
+    await session.commit()
+    return poll.id
+
+
+@app.get(
+    "/get-user-polls/",
+    status_code=status.HTTP_200_OK,
+    response_model=List[PollRead],
+)
 async def get_polls(
-    sid: str = Depends(get_session_cookie_value)
+    sid: str = Depends(get_session_cookie_value),
+    session: AsyncSession = Depends(get_session),
 ):
-    with Session(engine) as session:
-        statement = select(Poll)\
-            .where(Poll.user_id == sid)
-        result = session.exec(statement)
-        polls = result.all()
-        res = []
-        for poll in polls:
-            res.append(
-                {
-                    **poll.dict(),
-                    "options": [
-                        {
-                            **option.dict(exclude={"votes", "poll_id"}),
-                            "votes": len(option.votes),
-                        }
-                        for option in poll.options
-                    ],
-                }
-            )
-        session.close()
-        return res
+    return await get_user_polls(session, sid, vote_tally)
 
 
 @app.get("/get-poll/{poll_id}", status_code=status.HTTP_200_OK)
 async def get_poll(
     poll_id: str,
-    sid: str = Depends(get_session_cookie_value)
+    sid: str = Depends(get_session_cookie_value),
+    session: AsyncSession = Depends(get_session),
 ):
-    with Session(engine) as session:
-        statement = select(Poll).where(Poll.id == poll_id)
-        result = session.exec(statement)
-        poll = result.first()
-        if not poll:
-            return Response(status_code=404)
-        vote_statement = select(Vote).where(Vote.user_id == sid)\
-            .select_from(Vote)\
-            .where(Vote.option_id == Option.id)\
-            .where(Option.poll_id == poll_id)
-        vote = session.exec(vote_statement).first()
-        res = {
-            **poll.dict(),
-            "options": [
-                {
-                    **option.dict(exclude={"votes", "poll_id"}),
-                    "votes": len(option.votes),
-                }
-                for option in poll.options
-            ],
-            "has_voted": vote is not None,
-            "vote": vote.option_id if vote else "",
-        }
-        session.close()
-        return res
+    statement = select(Poll)\
+        .where(Poll.id == poll_id)\
+        .options(selectinload(Poll.options))
+    result = await session.exec(statement)
+    poll = result.first()
+    if not poll:
+        return Response(status_code=404)
+    vote_statement = select(Vote).where(Vote.user_id == sid)\
+        .select_from(Vote)\
+        .where(Vote.option_id == Option.id)\
+        .where(Option.poll_id == poll_id)
+    vote = (await session.exec(vote_statement)).first()
+    counts = await vote_tally.get(session, poll_id)
+    return {
+        **poll.dict(),
+        "options": serialize_options(poll.options, counts),
+        "has_voted": vote is not None,
+        "vote": vote.option_id if vote else "",
+    }
 
 
 @app.post("/vote/", status_code=status.HTTP_201_CREATED)
 async def vote(
     option_id: str,
-    sid: str = Depends(get_session_cookie_value)
+    sid: str = Depends(get_session_cookie_value),
+    session: AsyncSession = Depends(get_session),
 ):
-    with Session(engine) as session:
-        statement = select(Vote)\
-            .where(
-                Vote.user_id == sid,
-                Vote.option_id == option_id,
-                Vote.user_id == sid
-            )
-        vote = session.exec(statement).first()
-        if vote:
-            return Response(status_code=400)
-        vote = Vote(option_id=option_id, user_id=sid)
-        session.add(vote)
-        session.commit()
-        updated_options_statement = select(Option)\
-            .where(Option.poll_id == vote.option.poll_id)
-        updated_options = session.exec(updated_options_statement).all()
-        res = [
-            {
-                **option.dict(exclude={"votes", "poll_id"}),
-                "votes": len(option.votes),
-            }
-            for option in updated_options
-        ]
-        session.close()
-        # send the updated info to the connected clients
-        await ws_manager.send_message(
-            vote.option.poll_id, {"type": "voted", "payload": res}
-        )
+    poll_id = await vote_ingestor.poll_of(session, option_id)
+    if poll_id is None:
+        return Response(status_code=404)
+    # one vote per poll, whichever option it was for
+    if not await voter_index.claim(session, poll_id, sid):
+        return Response(status_code=400)
+    if vote_ingestor.batched:
+        # counted and broadcast once the batch is committed
+        await vote_ingestor.enqueue(poll_id, option_id, sid)
         return True
+    try:
+        session.add(Vote(option_id=option_id, user_id=sid, poll_id=poll_id))
+        await vote_tally.stage_vote(session, option_id)
+        await session.commit()
+    except IntegrityError:
+        # voted through another worker, the index hadn't seen it
+        await session.rollback()
+        voter_index.confirm(poll_id, [sid])
+        return Response(status_code=400)
+    except Exception:
+        voter_index.release(poll_id, sid)
+        raise
+    voter_index.confirm(poll_id, [sid])
+    vote_tally.increment(poll_id, option_id)
+    # the connected clients get the vote on the next tally tick
+    ws_manager.publish_vote(poll_id, option_id)
+    return True
 
 
 @app.delete("/poll/{poll_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delte_poll(
     sid: str = Depends(get_session_cookie_value),
     poll_id: str = None,
+    session: AsyncSession = Depends(get_session),
 ):
-    with Session(engine) as session:
-        statement = select(Poll)\
-            .where(Poll.id == poll_id, Poll.user_id == sid)
-        poll = session.exec(statement).first()
-        if not poll:
-            return Response(status_code=404)
-        session.delete(poll)
-        session.commit()
-        session.close()
-        return True
+    statement = select(Poll.id)\
+        .where(Poll.id == poll_id, Poll.user_id == sid)
+    if (await session.exec(statement)).first() is None:
+        return Response(status_code=404)
+    # bulk deletes instead of the ORM cascade, which would load every vote
+    option_ids = select(Option.id).where(Option.poll_id == poll_id)
+    await session.execute(delete(Vote).where(Vote.option_id.in_(option_ids)))
+    await session.execute(delete(Option).where(Option.poll_id == poll_id))
+    await session.execute(delete(Poll).where(Poll.id == poll_id))
+    await session.commit()
+    vote_tally.forget(poll_id)
+    vote_ingestor.forget(poll_id)
+    voter_index.forget(poll_id)
+    return True
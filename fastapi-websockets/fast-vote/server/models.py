@@ -1,16 +1,8 @@
 from datetime import datetime
 from typing import Optional, List
 from uuid import uuid4 as uuid
-from sqlmodel import Field, SQLModel, create_engine, Relationship
-
-sql_file_name = "database.db"
-sqlite_url = f"sqlite:///{sql_file_name}"
-
-engine = create_engine(sqlite_url, echo=True)
-
-
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+from sqlalchemy import UniqueConstraint
+from sqlmodel import Field, SQLModel, Relationship
 
 
 def get_defult_uuid():
@@ -18,14 +10,23 @@ def get_defult_uuid():
 
 
 class Vote(SQLModel, table=True):
+    # one vote per user and poll, whichever worker handles it
+    __table_args__ = (UniqueConstraint("poll_id", "user_id"),)
+
     id: Optional[str] = Field(
         default_factory=get_defult_uuid, primary_key=True
         )
-    user_id: str = Field(default=None, nullable=False)
+    user_id: str = Field(default=None, nullable=False, index=True)
+    poll_id: str = Field(
+        default=None,
+        foreign_key="poll.id",
+        nullable=False,
+    )
     option_id: str = Field(
         default=None,
         foreign_key="option.id",
-        nullable=False
+        nullable=False,
+        index=True,
     )
     option: "Option" = Relationship(
         back_populates="votes"
@@ -41,6 +42,9 @@ class Option(SQLModel, table=True):
         foreign_key="poll.id",
         default=None,
     )
+    # denormalized counter, only maintained when the tally is configured
+    # with use_vote_count_column
+    vote_count: int = Field(default=0, nullable=False)
     poll: "Poll" = Relationship(
         back_populates="options",
         )
@@ -81,3 +85,17 @@ class PollCreateBody(SQLModel):
                 "options": ["Red", "Blue", "Green", "Yellow", "Orange"]
             }
         }
+
+
+class OptionRead(SQLModel):
+    id: str
+    option_text: str
+    votes: int = 0
+
+
+class PollRead(SQLModel):
+    id: str
+    poll_text: str
+    pub_date: datetime
+    user_id: str
+    options: List[OptionRead] = []
@@ -0,0 +1,42 @@
+from typing import Dict, List
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Option, OptionRead, Poll, PollRead
+from tally import VoteTally
+
+
+async def get_user_polls(
+    session: AsyncSession, user_id: str, tally: VoteTally
+) -> List[PollRead]:
+    """All polls of a user with their options and vote counts.
+
+    One joined query for polls and options, plus at most one GROUP BY for
+    the polls whose counts aren't cached yet.
+    """
+    statement = select(
+        Poll.id, Poll.poll_text, Poll.pub_date, Poll.user_id,
+        Option.id, Option.option_text,
+    )\
+        .join(Option, Option.poll_id == Poll.id)\
+        .where(Poll.user_id == user_id)\
+        .order_by(Poll.pub_date, Poll.id)
+    polls: Dict[str, PollRead] = {}
+    rows = await session.exec(statement)
+    for poll_id, poll_text, pub_date, poll_user_id, option_id, text in rows:
+        poll = polls.get(poll_id)
+        if poll is None:
+            poll = polls[poll_id] = PollRead(
+                id=poll_id,
+                poll_text=poll_text,
+                pub_date=pub_date,
+                user_id=poll_user_id,
+                options=[],
+            )
+        poll.options.append(OptionRead(id=option_id, option_text=text))
+
+    counts = await tally.get_many(session, polls)
+    for poll_id, poll in polls.items():
+        poll_counts = counts.get(poll_id, {})
+        for option in poll.options:
+            option.votes = poll_counts.get(option.id, 0)
+    return list(polls.values())
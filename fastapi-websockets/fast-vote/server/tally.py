@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from sqlalchemy import func, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import Option, Vote
+
+logger = logging.getLogger(__name__)
+
+TOptionCounts = Dict[str, int]
+TPollCounts = Dict[str, TOptionCounts]
+# called with (poll_id, {option_id: votes}) for counts a reload corrected
+TCorrectionListener = Callable[[str, TOptionCounts], None]
+
+# keep Option.vote_count in sync with the vote table (in the same
+# transaction as the vote) and rebuild the cache from it instead of
+# counting Vote rows
+USE_VOTE_COUNT_COLUMN = False
+# a vote counted while its poll is loading, or up to RELOAD_WINDOW seconds
+# after, may be in the loaded counts already (or missing from them): such
+# polls are loaded again every RECONCILE_INTERVAL seconds until quiet
+RELOAD_WINDOW = 1.0
+RECONCILE_INTERVAL = 1.0
+
+
+class VoteTally:
+    """Per-option vote counters served from memory.
+
+    Counts are loaded with a single GROUP BY on startup (or per poll on a
+    cache miss) and bumped in place on every vote, so reading them no
+    longer depends on how many votes were cast. Votes of other workers
+    arrive up to a tally tick after their commit, so one can land right
+    after a load that already counted it; the polls where that can have
+    happened are reloaded by the reconciler started with `start`.
+    """
+
+    def __init__(
+        self,
+        use_vote_count_column: bool = USE_VOTE_COUNT_COLUMN,
+        reconcile_interval: float = RECONCILE_INTERVAL,
+    ):
+        self.counts: TPollCounts = {}
+        self.use_vote_count_column = use_vote_count_column
+        self.reconcile_interval = reconcile_interval
+        # poll_id -> when its counts finished loading (monotonic)
+        self.loaded_at: Dict[str, float] = {}
+        self.loading: Set[str] = set()
+        self.warming = False
+        self.suspect: Set[str] = set()
+        self.correction_listeners: List[TCorrectionListener] = []
+        self.reconciler: Optional[asyncio.Task] = None
+
+    async def start(self, session_factory):
+        self.reconciler = asyncio.create_task(self._reconcile_loop(session_factory))
+
+    async def stop(self):
+        if self.reconciler is not None:
+            self.reconciler.cancel()
+            self.reconciler = None
+
+    async def warm(self, session: AsyncSession):
+        self.counts = {}
+        self.warming = True
+        try:
+            await self._load(session)
+        finally:
+            self.warming = False
+
+    async def get(self, session: AsyncSession, poll_id: str) -> TOptionCounts:
+        counts = self.counts.get(poll_id)
+        if counts is None:
+            # a vote committed while this query runs may be missed, the
+            # window is limited to the first read of a poll
+            await self._load(session, [poll_id])
+            counts = self.counts.get(poll_id, {})
+        return counts
+
+    def cached(self, poll_id: str) -> Optional[TOptionCounts]:
+        """Counts of a poll without querying, None if it isn't loaded."""
+        return self.counts.get(poll_id)
+
+    async def get_many(
+        self, session: AsyncSession, poll_ids: Iterable[str]
+    ) -> TPollCounts:
+        """Counts of several polls, loading all missing ones in one query."""
+        poll_ids = list(poll_ids)
+        missing = [
+            poll_id for poll_id in poll_ids if poll_id not in self.counts
+        ]
+        if missing:
+            await self._load(session, missing)
+        return {
+            poll_id: self.counts.get(poll_id, {}) for poll_id in poll_ids
+        }
+
+    async def stage_vote(
+        self, session: AsyncSession, option_id: str, by: int = 1
+    ):
+        """Add the counter update to the vote's transaction, if enabled."""
+        if not self.use_vote_count_column:
+            return
+        await session.execute(
+            update(Option)
+            .where(Option.id == option_id)
+            .values(vote_count=Option.vote_count + by)
+        )
+
+    def increment(self, poll_id: str, option_id: str, by: int = 1):
+        # must run after the vote is committed; a poll that isn't cached
+        # yet will pick the vote up when it is loaded
+        loaded_at = self.loaded_at.get(poll_id)
+        if self.warming or poll_id in self.loading or (
+            loaded_at is not None and time.monotonic() - loaded_at < RELOAD_WINDOW
+        ):
+            self.suspect.add(poll_id)
+        counts = self.counts.get(poll_id)
+        if counts is not None:
+            counts[option_id] = counts.get(option_id, 0) + by
+
+    def apply(self, poll_id: str, increments: TOptionCounts):
+        for option_id, by in increments.items():
+            self.increment(poll_id, option_id, by)
+
+    def forget(self, poll_id: str):
+        self.counts.pop(poll_id, None)
+        self.loaded_at.pop(poll_id, None)
+        self.suspect.discard(poll_id)
+
+    async def reconcile(self, session: AsyncSession) -> TPollCounts:
+        """Reloads the suspect polls, returns the counts that changed."""
+        poll_ids = [poll_id for poll_id in self.suspect if poll_id in self.counts]
+        self.suspect = set()
+        if not poll_ids:
+            return {}
+        before = {poll_id: dict(self.counts[poll_id]) for poll_id in poll_ids}
+        await self._load(session, poll_ids)
+        changed = {}
+        for poll_id in poll_ids:
+            counts = {
+                option_id: votes
+                for option_id, votes in self.counts.get(poll_id, {}).items()
+                if before[poll_id].get(option_id) != votes
+            }
+            if counts:
+                changed[poll_id] = counts
+        return changed
+
+    async def _reconcile_loop(self, session_factory):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            if not self.suspect:
+                continue
+            try:
+                async with session_factory() as session:
+                    changed = await self.reconcile(session)
+            except Exception:
+                logger.exception("could not reload vote counts")
+                continue
+            for poll_id, counts in changed.items():
+                for listener in self.correction_listeners:
+                    listener(poll_id, counts)
+
+    async def _load(
+        self,
+        session: AsyncSession,
+        poll_ids: Optional[Iterable[str]] = None,
+    ):
+        if self.use_vote_count_column:
+            statement = select(Option.poll_id, Option.id, Option.vote_count)
+        else:
+            statement = select(Option.poll_id, Option.id, func.count(Vote.id))\
+                .outerjoin(Vote, Vote.option_id == Option.id)\
+                .group_by(Option.poll_id, Option.id)
+        if poll_ids is not None:
+            poll_ids = list(poll_ids)
+            statement = statement.where(Option.poll_id.in_(poll_ids))
+            self.loading.update(poll_ids)
+        try:
+            loaded = set()
+            for poll_id, option_id, count in await session.exec(statement):
+                self.counts.setdefault(poll_id, {})[option_id] = count
+                loaded.add(poll_id)
+        finally:
+            if poll_ids is not None:
+                self.loading.difference_update(poll_ids)
+        now = time.monotonic()
+        for poll_id in loaded:
+            self.loaded_at[poll_id] = now
+
+
+vote_tally = VoteTally()
@@ -1,23 +1,362 @@
-from typing import Dict, Any, Set
+import asyncio
+import json
+import struct
+from typing import Callable, Dict, Any, List, Optional, Set, Union
+from uuid import uuid4 as uuid
 from fastapi import WebSocket
+from backplane import Backplane, make_backplane
 
 TMessagePayload = Any
-TActiveConnections = Dict[str, Set[WebSocket]]
+# text frames for JSON clients, bytes for binary ones
+TFrame = Union[str, bytes]
+TActiveConnections = Dict[str, Set["Connection"]]
+# called with (poll_id, {option_id: new votes}) for votes cast on other workers
+TTallyListener = Callable[[str, Dict[str, int]], None]
+# returns the current {option_id: votes} of a poll, None if it isn't loaded
+TCountsSource = Callable[[str], Optional[Dict[str, int]]]
 
+# how many serialized messages may wait for a single slow client
+SEND_QUEUE_SIZE = 32
+# what to do when a client's queue is full: "disconnect" or "drop"
+OVERFLOW_DISCONNECT = "disconnect"
+OVERFLOW_DROP = "drop"
+# close code sent to clients that can't keep up (1013 = try again later)
+SLOW_CLIENT_CLOSE_CODE = 1013
+# votes for a poll are folded into one "tally" message per tick (seconds),
+# 0 only folds votes cast in the same event loop iteration
+TALLY_TICK = 0.05
+# every HEARTBEAT_INTERVAL seconds each client gets a ping it has to answer;
+# clients silent for longer than IDLE_TIMEOUT seconds are disconnected
+HEARTBEAT_INTERVAL = 20
+IDLE_TIMEOUT = 60
+# close code sent to clients that stopped answering (1001 = going away)
+IDLE_CLIENT_CLOSE_CODE = 1001
+# how a client wants its frames, picked with /ws/poll/{id}?encoding=...
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary"
+# binary frames start with one of these, followed by little-endian fields
+BINARY_TALLY = 1  # (uint8 option index, uint32 votes) per changed option
+BINARY_PING = 2
+
+
+def encode_message(message: TMessagePayload) -> str:
+    # same encoding as WebSocket.send_json, but done once per broadcast
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+PING = encode_message({"type": "ping"})
+BINARY_PING_FRAME = bytes([BINARY_PING])
+TALLY_ENTRY = struct.Struct("<BI")
+
+
+def encode_binary_tally(
+    payload: Dict[str, int], option_index: Dict[str, int]
+) -> Optional[bytes]:
+    """Pack a tally payload by option index, None if an option is unknown."""
+    frame = bytearray([BINARY_TALLY])
+    for option_id, votes in payload.items():
+        index = option_index.get(option_id)
+        if index is None:
+            return None
+        frame += TALLY_ENTRY.pack(index, votes)
+    return bytes(frame)
+
+
+def encode_envelope(origin: str, poll_id: str, data: str) -> bytes:
+    return f"{origin}|{poll_id}|{data}".encode()
+
+
+def decode_envelope(envelope: bytes):
+    origin, poll_id, data = envelope.decode().split("|", 2)
+    return origin, poll_id, data
+
+
+class Connection:
+    """A websocket plus its bounded send queue and writer task."""
+
+    def __init__(
+        self, poll_id: str, ws: WebSocket, queue_size: int, binary: bool
+    ):
+        self.poll_id = poll_id
+        self.ws = ws
+        self.binary = binary
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task = None
+        self.last_seen = asyncio.get_running_loop().time()
+
+
+class TallyMetrics:
+    """Counters describing how well votes are being coalesced."""
 
-class WSManager:
     def __init__(self):
+        self.ticks = 0
+        self.votes = 0
+        self.max_batch = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def record(self, batch: int, lag: float):
+        self.ticks += 1
+        self.votes += batch
+        self.max_batch = max(self.max_batch, batch)
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "ticks": self.ticks,
+            "votes": self.votes,
+            "avg_batch": self.votes / self.ticks if self.ticks else 0,
+            "max_batch": self.max_batch,
+            "avg_tick_lag_ms": (
+                self.total_lag / self.ticks * 1000 if self.ticks else 0
+            ),
+            "max_tick_lag_ms": self.max_lag * 1000,
+        }
+
+
+class WSManager:
+    def __init__(
+        self,
+        queue_size: int = SEND_QUEUE_SIZE,
+        overflow: str = OVERFLOW_DISCONNECT,
+        tally_tick: float = TALLY_TICK,
+        backplane: Backplane = None,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        idle_timeout: float = IDLE_TIMEOUT,
+    ):
         self.active_connections: TActiveConnections = {}
+        self.connections_by_ws: Dict[WebSocket, Connection] = {}
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.dropped_messages = 0
+        self.kicked_clients = 0
+        self.idle_clients = 0
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.heartbeat: asyncio.Task = None
+        self.tally_tick = tally_tick
+        # poll_id -> {option_id: votes cast} waiting for the next tick
+        self.pending_tallies: Dict[str, Dict[str, int]] = {}
+        self.pending_votes: Dict[str, int] = {}
+        self.tally_metrics = TallyMetrics()
+        self.tally_listeners: List[TTallyListener] = []
+        # where tally messages take their counts from, set by the app
+        self.counts_source: Optional[TCountsSource] = None
+        self.backplane = backplane or make_backplane()
+        self.node_id = uuid().hex
+        self.publishing: Set[asyncio.Task] = set()
+        # close handshakes of kicked clients, kept so they aren't collected
+        self.closing: Set[asyncio.Task] = set()
+        # poll_id -> {option_id: position}, the layout of binary tallies
+        self.option_index: Dict[str, Dict[str, int]] = {}
+
+    async def start(self):
+        await self.backplane.start(self._on_backplane_message)
+        self.heartbeat = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+        await self.backplane.stop()
+
+    async def connect(
+        self,
+        poll_id: str,
+        ws: WebSocket,
+        encoding: str = ENCODING_JSON,
+        option_ids: List[str] = (),
+    ):
+        """Subscribe `ws` to the poll.
+
+        Binary clients refer to options by their position in `option_ids`.
+        """
+        binary = encoding == ENCODING_BINARY
+        if binary:
+            self.option_index.setdefault(poll_id, {
+                option_id: i for i, option_id in enumerate(option_ids)
+            })
+        conn = Connection(poll_id, ws, self.queue_size, binary)
+        conn.writer = asyncio.create_task(self._writer(conn))
+        self.active_connections.setdefault(poll_id, set()).add(conn)
+        self.connections_by_ws[ws] = conn
 
-    async def connect(self, poll_id: str, ws: WebSocket):
-        self.active_connections.setdefault(poll_id, set()).add(ws)
+    def touch(self, ws: WebSocket):
+        """Record that the client behind `ws` is still there."""
+        conn = self.connections_by_ws.get(ws)
+        if conn is not None:
+            conn.last_seen = asyncio.get_running_loop().time()
 
     async def disconnect(self, poll_id: str, ws: WebSocket):
-        self.active_connections[poll_id].remove(ws)
+        conn = self.connections_by_ws.pop(ws, None)
+        if conn is None:
+            return
+        self._forget(conn)
+        if conn.writer is not None and \
+                conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
 
     async def send_message(self, poll_id: str, message: TMessagePayload):
-        for ws in self.active_connections.get(poll_id, []):
-            await ws.send_json(message)
+        """Queue `message` for every socket of the poll and return.
+
+        The payload is serialized once and goes through the backplane, so
+        the sockets held by other workers get it as well. The actual socket
+        writes happen in each connection's writer task, so a slow client
+        never holds up the caller or the other clients.
+        """
+        await self.backplane.publish(
+            encode_envelope(self.node_id, poll_id, encode_message(message))
+        )
+
+    def publish_vote(self, poll_id: str, option_id: str):
+        """Schedule a vote for `option_id` to go out on the next tick.
+
+        Every vote cast on a poll during a tick ends up in a single
+        `{"type": "tally", "payload": {option_id: votes}}` message holding
+        the vote count of each option that changed. Workers exchange the
+        number of new votes, so each can bring its counts up to date, but
+        clients get the counts themselves: a message that arrives twice,
+        late or not at all is corrected by the next one.
+        """
+        pending = self.pending_tallies.get(poll_id)
+        if pending is None:
+            pending = self.pending_tallies[poll_id] = {}
+            self.pending_votes[poll_id] = 0
+            loop = asyncio.get_running_loop()
+            due = loop.time() + self.tally_tick
+            loop.call_at(due, self._flush_tally, poll_id, due)
+        pending[option_id] = pending.get(option_id, 0) + 1
+        self.pending_votes[poll_id] += 1
+
+    def _flush_tally(self, poll_id: str, due: float):
+        lag = asyncio.get_running_loop().time() - due
+        pending = self.pending_tallies.pop(poll_id)
+        batch = self.pending_votes.pop(poll_id)
+        self.tally_metrics.record(batch, max(lag, 0.0))
+        data = encode_message({"type": "votes", "payload": pending})
+        task = asyncio.create_task(self.backplane.publish(
+            encode_envelope(self.node_id, poll_id, data)
+        ))
+        self.publishing.add(task)
+        task.add_done_callback(self.publishing.discard)
+
+    def _on_backplane_message(self, envelope: bytes):
+        origin, poll_id, data = decode_envelope(envelope)
+        message = json.loads(data)
+        if message.get("type") != "votes":
+            self.broadcast_encoded(poll_id, data)
+            return
+        if origin != self.node_id:
+            # our own votes are already counted
+            for listener in self.tally_listeners:
+                listener(poll_id, message["payload"])
+        if poll_id not in self.active_connections or self.counts_source is None:
+            return
+        counts = self.counts_source(poll_id)
+        if counts is None:
+            return
+        self.broadcast_counts(poll_id, {
+            option_id: counts.get(option_id, 0) for option_id in message["payload"]
+        })
+
+    def broadcast_counts(self, poll_id: str, counts: Dict[str, int]):
+        """Send this worker's clients of the poll absolute vote counts."""
+        self.broadcast_encoded(poll_id, encode_message({"type": "tally", "payload": counts}))
+
+    def broadcast_encoded(self, poll_id: str, data: str):
+        connections = self.active_connections.get(poll_id)
+        if not connections:
+            return
+        binary = None
+        if any(conn.binary for conn in connections):
+            binary = self._to_binary(poll_id, data)
+        # iterate over a copy, overflowing clients are removed as we go
+        for conn in list(connections):
+            if conn.binary and binary is not None:
+                self._enqueue(conn, binary)
+            else:
+                self._enqueue(conn, data)
+
+    def _to_binary(self, poll_id: str, data: str) -> Optional[bytes]:
+        # once per message and worker; anything but a tally stays JSON
+        message = json.loads(data)
+        if message.get("type") != "tally":
+            return None
+        return encode_binary_tally(
+            message["payload"], self.option_index.get(poll_id, {})
+        )
+
+    def _enqueue(self, conn: Connection, data: TFrame):
+        try:
+            conn.queue.put_nowait(data)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.overflow == OVERFLOW_DROP:
+            # lossy: the client shows stale counts for the options of the
+            # oldest message until the next tally with those options
+            conn.queue.get_nowait()
+            conn.queue.put_nowait(data)
+            self.dropped_messages += 1
+            return
+        self.kicked_clients += 1
+        self._kick(conn, SLOW_CLIENT_CLOSE_CODE)
+
+    def _kick(self, conn: Connection, code: int):
+        self.connections_by_ws.pop(conn.ws, None)
+        self._forget(conn)
+        if conn.writer is not None:
+            conn.writer.cancel()
+        task = asyncio.create_task(self._close(conn.ws, code))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    def _forget(self, conn: Connection):
+        connections = self.active_connections.get(conn.poll_id)
+        if connections is None:
+            return
+        connections.discard(conn)
+        if not connections:
+            del self.active_connections[conn.poll_id]
+            self.option_index.pop(conn.poll_id, None)
+
+    async def _heartbeat(self):
+        # a single timer for all sockets instead of one per connection
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            idle_since = loop.time() - self.idle_timeout
+            for conn in list(self.connections_by_ws.values()):
+                if conn.last_seen < idle_since:
+                    self.idle_clients += 1
+                    self._kick(conn, IDLE_CLIENT_CLOSE_CODE)
+                elif not conn.queue.full():
+                    # a client with a full queue is busy anyway
+                    conn.queue.put_nowait(
+                        BINARY_PING_FRAME if conn.binary else PING
+                    )
+
+    async def _writer(self, conn: Connection):
+        try:
+            while True:
+                data = await conn.queue.get()
+                if isinstance(data, bytes):
+                    await conn.ws.send_bytes(data)
+                else:
+                    await conn.ws.send_text(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the socket is gone, the receive loop will see it as well
+            await self.disconnect(conn.poll_id, conn.ws)
+
+    @staticmethod
+    async def _close(ws: WebSocket, code: int):
+        try:
+            await ws.close(code=code)
+        except Exception:
+            pass
 
 
 ws_manager = WSManager()